@@ -1,10 +1,30 @@
+import time
+
+from app import startup
+
+_import_started = time.perf_counter()
+
 from flask import Flask
 from app.routes import init_routes
-from app.camera import init_camera
+from app.camera import cameras, configure_source
+from app.cleanup import temp_cleaner
+from app.config import CAMERA_WARM_START, CAMERA_KEEP_WARM
+
+startup.record("import", time.perf_counter() - _import_started)
+
+def create_app(source_options=None):
+    with startup.phase("create_app"):
+        app = Flask(__name__)
+        app.debug = True
+        if source_options:
+            configure_source(**source_options)
+        init_routes(app)
+    # Periodic OpenCV temp file cleanup; requests can also trigger it, rate limited
+    temp_cleaner.start()
 
-def create_app():
-    app = Flask(__name__)
-    app.debug = True
-    init_camera()
-    init_routes(app)
+    # Cameras are opened in the background while the server is already accepting connections
+    if CAMERA_WARM_START or CAMERA_KEEP_WARM:
+        startup.warm_start(cameras.values())
+    else:
+        startup.skip_warm_start()
     return app
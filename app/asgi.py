@@ -0,0 +1,354 @@
+"""Asyncio serving mode.
+
+MJPEG streams run as asyncio tasks woken by the shared frame grabber, so each viewer
+costs a coroutine instead of a server worker thread. The same frames are also served
+over WebSocket, one binary message per frame, paced by credits the client returns.
+Every other route is passed through to the Flask app unchanged.
+
+Requires the optional `asgiref` and `uvicorn` packages (and `websockets` for the
+WebSocket endpoint).
+"""
+import asyncio
+import json
+import logging
+import re
+import struct
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import camera, metrics
+from app.encoding import parse_variant_args
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = re.compile(r"^/video_feed(?:/(?P<cam_id>[^/]+))?$")
+WS_PATH = re.compile(r"^/ws/video_feed(?:/(?P<cam_id>[^/]+))?$")
+
+# Header of each binary WebSocket frame message: version, frame sequence number, capture
+# time (unix seconds) and camera id length, followed by the camera id (UTF-8) and the JPEG
+WS_FRAME_HEADER = struct.Struct("!BQdB")
+WS_HEADER_VERSION = 1
+# Frames a client may have in flight unless it asks for a different number with ?credits=
+WS_DEFAULT_CREDITS = 2
+WS_MAX_CREDITS = 32
+
+ws_ack_seconds = metrics.Histogram(
+    "websocket_frame_ack_seconds", "Time from sending a WebSocket frame until the client acknowledged it", ["camera"])
+
+
+class FrameSignal:
+    """Wakes every stream task on one event loop when the grabber publishes a frame.
+
+    A single grabber listener hands each frame to the loop once; the waiting tasks
+    then pull it from their own subscriber mailboxes.
+    """
+
+    def __init__(self, grabber, loop):
+        self.grabber = grabber
+        self.loop = loop
+        self.waiters = 0
+        self._next = loop.create_future()
+
+    def _on_frame(self, item):
+        # Grabber thread
+        self.loop.call_soon_threadsafe(self._publish)
+
+    def _publish(self):
+        future, self._next = self._next, self.loop.create_future()
+        future.set_result(None)
+
+    def attach(self):
+        self.waiters += 1
+        if self.waiters == 1:
+            self.grabber.add_listener(self._on_frame)
+
+    def detach(self):
+        self.waiters -= 1
+        if self.waiters == 0:
+            self.grabber.remove_listener(self._on_frame)
+
+    def next(self):
+        """Future resolved when the next frame is published."""
+        return self._next
+
+    async def wait(self, future, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class CreditWindow:
+    """Frames a WebSocket client is ready to receive.
+
+    Sending a frame uses one credit; the client returns it by acknowledging the frame
+    ({"ack": seq}) or grants more with {"credits": n}. With no credits left the server
+    sends nothing, so frames never queue up in the client or the network.
+    """
+
+    def __init__(self, credits):
+        self.credits = credits
+        self.sent = {}
+        self._available = asyncio.Event()
+        if credits > 0:
+            self._available.set()
+
+    def take(self, seq, now):
+        self.credits -= 1
+        if self.credits <= 0:
+            self._available.clear()
+        self.sent[seq] = now
+        if len(self.sent) > 4 * WS_MAX_CREDITS:
+            # Client grants credits without acknowledging frames; forget the oldest send times
+            del self.sent[next(iter(self.sent))]
+
+    def grant(self, count):
+        self.credits = min(self.credits + count, WS_MAX_CREDITS)
+        if self.credits > 0:
+            self._available.set()
+
+    def close(self):
+        self._available.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._available.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+async def _send_error(send, status, message):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": message.encode()})
+
+
+async def _next_frame(cam, subscriber, signal, disconnected):
+    """Wait for the subscriber's next frame; None once the client left or the camera is gone."""
+    loop = asyncio.get_running_loop()
+    while not disconnected.is_set():
+        # Take the wakeup future before polling so a frame published in between is not missed
+        next_frame = signal.next()
+        item = subscriber.next_frame(timeout=0)
+        if item is not None:
+            return item
+        if await signal.wait(next_frame, camera.FRAME_WAIT_TIMEOUT):
+            continue
+        if cam.shutdown_flag:
+            logger.info(f"Shutdown detected during streaming on camera {cam.id}")
+            return None
+        if not await loop.run_in_executor(None, cam.ensure):
+            logger.error(f"Camera {cam.id} unavailable for streaming")
+            return None
+    return None
+
+
+async def stream_mjpeg(scope, receive, send, cam, signal, params):
+    route = "/video_feed" if scope["path"] == "/video_feed" else "/video_feed/<cam_id>"
+    loop = asyncio.get_running_loop()
+    subscriber = await loop.run_in_executor(None, cam.open_stream, params)
+    signal.attach()
+    disconnected = asyncio.Event()
+    watcher = loop.create_task(_watch_disconnect(receive, disconnected))
+    try:
+        if not await loop.run_in_executor(None, cam.ensure):
+            logger.error(f"Camera {cam.id} unavailable for streaming")
+            await _send_error(send, 503, "Camera unavailable")
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"multipart/x-mixed-replace;boundary=frame")],
+        })
+
+        while not disconnected.is_set():
+            item = await _next_frame(cam, subscriber, signal, disconnected)
+            if item is None:
+                break
+
+            seq, _, frame = item
+            payload = await asyncio.wrap_future(subscriber.variant.submit(seq, frame))
+            part = camera.mjpeg_part(payload)
+            await send({"type": "http.response.body", "body": part, "more_body": True})
+            metrics.bytes_sent.inc(len(part), route=route)
+
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    except OSError:
+        # Client went away mid-write
+        pass
+    finally:
+        watcher.cancel()
+        signal.detach()
+        await loop.run_in_executor(None, cam.close_stream, subscriber)
+
+
+async def _receive_credits(receive, window, cam, disconnected):
+    """Apply the client's acknowledgements and credit grants until it disconnects."""
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message["type"] == "websocket.disconnect":
+            disconnected.set()
+            window.close()
+            return
+        if message["type"] != "websocket.receive":
+            continue
+        try:
+            data = json.loads(message.get("text") or message.get("bytes") or b"")
+            if "ack" in data:
+                sent_at = window.sent.pop(int(data["ack"]), None)
+                if sent_at is not None:
+                    ws_ack_seconds.observe(loop.time() - sent_at, camera=cam.id)
+                window.grant(1)
+            if "credits" in data:
+                count = int(data["credits"])
+                # A negative grant would let a client stall its own stream
+                if count <= 0:
+                    raise ValueError(count)
+                window.grant(count)
+        except (ValueError, TypeError):
+            logger.warning(f"Ignoring malformed WebSocket message on camera {cam.id}")
+
+
+async def stream_websocket(scope, receive, send, cam, signal, params, credits):
+    """Send each frame as one binary message (WS_FRAME_HEADER + camera id + JPEG), paced by client credits."""
+    route = "/ws/video_feed" if scope["path"] == "/ws/video_feed" else "/ws/video_feed/<cam_id>"
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    loop = asyncio.get_running_loop()
+    subscriber = await loop.run_in_executor(None, cam.open_stream, params)
+    signal.attach()
+    disconnected = asyncio.Event()
+    window = CreditWindow(credits)
+    receiver = None
+    try:
+        if not await loop.run_in_executor(None, cam.ensure):
+            logger.error(f"Camera {cam.id} unavailable for streaming")
+            await send({"type": "websocket.close", "code": 1011})
+            return
+        await send({"type": "websocket.accept"})
+        receiver = loop.create_task(_receive_credits(receive, window, cam, disconnected))
+        cam_id = cam.id.encode()[:255]
+
+        while not disconnected.is_set():
+            if not await window.wait(camera.FRAME_WAIT_TIMEOUT) or disconnected.is_set():
+                continue
+            # The mailbox holds only the newest frame, so whatever was published while the
+            # client had no credits is skipped rather than queued
+            item = await _next_frame(cam, subscriber, signal, disconnected)
+            if item is None:
+                break
+
+            seq, timestamp, frame = item
+            payload = await asyncio.wrap_future(subscriber.variant.submit(seq, frame))
+            if disconnected.is_set():
+                break
+            data = WS_FRAME_HEADER.pack(WS_HEADER_VERSION, seq, timestamp, len(cam_id)) + cam_id + payload
+            window.take(seq, loop.time())
+            await send({"type": "websocket.send", "bytes": data})
+            metrics.bytes_sent.inc(len(data), route=route)
+
+        if not disconnected.is_set():
+            await send({"type": "websocket.close", "code": 1001})
+    except OSError:
+        # Client went away mid-write
+        pass
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        signal.detach()
+        await loop.run_in_executor(None, cam.close_stream, subscriber)
+
+
+def _parse_ws_args(query):
+    args = dict(parse_qsl(query.decode()))
+    params = parse_variant_args(args)
+    try:
+        credits = int(args.get("credits", WS_DEFAULT_CREDITS))
+    except ValueError:
+        raise ValueError("'credits' must be an integer")
+    if not 1 <= credits <= WS_MAX_CREDITS:
+        raise ValueError(f"'credits' must be between 1 and {WS_MAX_CREDITS}")
+    return params, credits
+
+
+def create_asgi_app(flask_app):
+    """Wrap the Flask app, serving /video_feed[/<cam_id>] natively with asyncio."""
+    wsgi = WsgiToAsgi(flask_app)
+    signals = {}
+
+    def signal_for(cam):
+        key = (asyncio.get_running_loop(), cam.grabber)
+        if key not in signals:
+            signals[key] = FrameSignal(cam.grabber, key[0])
+        return signals[key]
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    camera.shutdown_camera()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        match = STREAM_PATH.match(scope["path"]) if scope["type"] == "http" else None
+        if match:
+            try:
+                cam = camera.get_camera(match.group("cam_id"))
+            except KeyError:
+                await _send_error(send, 404, f"Unknown camera '{match.group('cam_id')}'")
+                return
+            try:
+                params = parse_variant_args(dict(parse_qsl(scope.get("query_string", b"").decode())))
+            except ValueError as e:
+                await _send_error(send, 400, str(e))
+                return
+            await stream_mjpeg(scope, receive, send, cam, signal_for(cam), params)
+            return
+
+        if scope["type"] == "websocket":
+            match = WS_PATH.match(scope["path"])
+            try:
+                cam = camera.get_camera(match.group("cam_id")) if match else None
+                params, credits = _parse_ws_args(scope.get("query_string", b""))
+            except KeyError:
+                logger.warning(f"Rejected WebSocket connection to {scope['path']}: unknown camera")
+                cam = None
+            except ValueError as e:
+                logger.warning(f"Rejected WebSocket connection to {scope['path']}: {e}")
+                cam = None
+            if cam is None:
+                # Closing before accepting rejects the handshake (HTTP 403)
+                await receive()
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            await stream_websocket(scope, receive, send, cam, signal_for(cam), params, credits)
+            return
+
+        await wsgi(scope, receive, send)
+
+    return app
+
+
+def serve_asgi(flask_app, host, port):
+    """Run the app under uvicorn"""
+    import uvicorn
+
+    uvicorn.run(create_asgi_app(flask_app), host=host, port=port, log_config=None, lifespan="on")
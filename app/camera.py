@@ -154,180 +154,425 @@
 # # Register cleanup function
 # atexit.register(shutdown_camera)
 
-import cv2
 from flask import jsonify
-import logging, os, tempfile
+import logging, os, sys
 import threading
 import time
 import atexit
 import signal  # Import signal to handle termination signals
-from app.config import IMAGE_PATH
-
-# Global variables
-camera = None
-camera_lock = threading.Lock()
-active_streams = 0
-shutdown_flag = False
-last_camera_use = 0
-
-# Configurable camera idle timeout (in seconds)
-CAMERA_IDLE_TIMEOUT = 60  # ⬅ Increased from 5 to 60
-
-def init_camera():
-    """Initialize camera using DirectShow backend on Windows"""
-    global camera, shutdown_flag, last_camera_use
-    if shutdown_flag:
-        return None
-
-    logging.info("Initializing camera...")
-
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # ⬅ Use DirectShow to reduce temp files
-    if cap.isOpened():
-        logging.info("Camera initialized successfully at device 0")
-        time.sleep(1)
-        last_camera_use = time.time()
-        return cap
-    else:
-        logging.error("Failed to open camera at device 0")
-        cap.release()
+from contextlib import contextmanager
+from app.config import (
+    IMAGE_FOLDER,
+    IMAGE_PATH,
+    JPEG_QUALITY,
+    FRAME_RING_SIZE,
+    SNAPSHOT_MAX_AGE,
+    CAPTURE_BEST_OF,
+    CAPTURE_BEST_OF_WINDOW,
+    CAMERA_IDLE_TIMEOUT,
+    CAMERA_KEEP_WARM,
+    MOTION_GATE,
+    MOTION_THRESHOLD,
+    MOTION_PIXEL_THRESHOLD,
+    MOTION_KEEPALIVE,
+    CAMERA_SOURCE,
+    CAMERA_DEVICE,
+    CAMERA_DEVICES,
+    CAMERA_BACKEND,
+    CAMERA_SOURCE_PATH,
+    CAMERA_FPS,
+    CAMERA_WIDTH,
+    CAMERA_HEIGHT,
+)
+from app import metrics
+from app.captures import capture_store
+from app.encoding import EncodeCache, StreamVariant
+from app.grabber import FrameGrabber
+from app.motion import MotionGate
+from app.processing import FramePipeline, parse_pipeline_config
+from app.quality import rank_frames, scoring_seconds, thumbnail
+from app.sources import open_source
+
+# Frame source settings shared by all cameras; defaults come from app.config and can be overridden by run.py
+source_options = {
+    "source": CAMERA_SOURCE,
+    "device": CAMERA_DEVICE,
+    "backend": CAMERA_BACKEND,
+    "path": CAMERA_SOURCE_PATH,
+    "fps": CAMERA_FPS,
+    "width": CAMERA_WIDTH,
+    "height": CAMERA_HEIGHT,
+}
+
+# How long a stream or capture waits for the grabber to publish a frame (in seconds)
+FRAME_WAIT_TIMEOUT = 2
+
+def mjpeg_part(payload):
+    """Wrap a JPEG payload as one part of the multipart/x-mixed-replace stream"""
+    return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + payload + b'\r\n\r\n'
+
+class Camera:
+    """One capture device with its own grabber thread, lock, encode cache and stats"""
+
+    def __init__(self, cam_id, options, image_path, pipeline_config=()):
+        self.id = cam_id
+        self.options = options
+        self.image_path = image_path
+        self.lock = threading.Lock()
+        self.active_streams = 0
+        self.shutdown_flag = False
+        self.opens = 0
+        self.captures = 0
+
+        # Supervisor thread that owns the device and fans frames out to every consumer
+        gate = MotionGate(MOTION_THRESHOLD, MOTION_PIXEL_THRESHOLD, MOTION_KEEPALIVE) if MOTION_GATE else None
+        # Overlays/rotation/masks applied once per frame, before any consumer sees it
+        self.pipeline = FramePipeline(cam_id, pipeline_config)
+        self.grabber = FrameGrabber(self.open_source, name=cam_id, ring_size=FRAME_RING_SIZE,
+                                    idle_timeout=CAMERA_IDLE_TIMEOUT, keep_warm=CAMERA_KEEP_WARM, gate=gate,
+                                    pipeline=self.pipeline)
+        # Encoded JPEG payloads shared by every subscriber of the grabber
+        self.encode_cache = EncodeCache()
+        # Stream variants (size/fps/quality) in use, keyed by their parameters
+        self.variants = {}
+
+    @contextmanager
+    def locked(self):
+        """Hold the camera lock, recording how long it took to acquire"""
+        with metrics.lock_wait_seconds.time(camera=self.id):
+            self.lock.acquire()
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def open_source(self):
+        """Open the configured frame source (camera device, video file or synthetic pattern)"""
+        if self.shutdown_flag:
+            return None
+
+        logging.info(f"Initializing camera {self.id}...")
+
+        cap = open_source(**self.options)
+        if cap is not None:
+            logging.info(f"Camera {self.id} initialized successfully: {cap.description}")
+            self.opens += 1
+            return cap
         return None
 
-def _ensure_camera():
-    """Ensure camera is ready for use"""
-    global camera, last_camera_use
-    with camera_lock:
-        if shutdown_flag:
-            logging.warning("Shutdown requested. Not reopening camera.")
-            return False
-
-        if camera is None or not camera.isOpened():
-            camera = init_camera()
-        elif time.time() - last_camera_use > CAMERA_IDLE_TIMEOUT:
-            camera.release()
-            camera = init_camera()
-    return camera is not None
-
-def reopen_camera():
-    global shutdown_flag
-    with camera_lock:
-        shutdown_flag = False
-    return jsonify({"message": "Camera re-enabled."})
-
-def generate_frames():
-    global active_streams, camera, last_camera_use, shutdown_flag
-
-    active_streams += 1
-    try:
-        with camera_lock:
-            if shutdown_flag:
-                logging.info("Shutdown flag detected — attempting to reopen camera")
-                shutdown_flag = False
-
-        while True:
-            if not _ensure_camera():
-                logging.error("Camera unavailable for streaming")
-                break
+    def ensure(self):
+        """Ensure the grabber thread is running"""
+        with self.locked():
+            if self.shutdown_flag:
+                logging.warning(f"Shutdown requested. Not reopening camera {self.id}.")
+                return False
+        return self.grabber.start()
+
+    def reopen(self):
+        with self.locked():
+            self.shutdown_flag = False
+
+    def open_stream(self, params=None):
+        """Register a new stream client for the variant described by `params` and subscribe it to the grabber"""
+        params = params or {}
+        key = (params.get("width"), params.get("height"), params.get("fps"), params.get("quality", JPEG_QUALITY))
+        with self.locked():
+            self.active_streams += 1
+            if self.shutdown_flag:
+                logging.info(f"Shutdown flag detected — attempting to reopen camera {self.id}")
+                self.shutdown_flag = False
+            variant = self.variants.get(key)
+            if variant is None:
+                variant = self.variants[key] = StreamVariant(self.encode_cache, *key)
+                logging.info(f"Camera {self.id}: started stream variant {variant.describe()}")
+            variant.subscribers += 1
+        return self.grabber.subscribe(variant=variant)
+
+    def close_stream(self, subscriber):
+        """Unregister a stream client; the supervisor closes the camera once it has been idle long enough"""
+        subscriber.close()
+        logging.info(f"Stream {subscriber.id} on camera {self.id} closed after {subscriber.frames_delivered} frames "
+                     f"({subscriber.frames_dropped} dropped)")
+        with self.locked():
+            self.active_streams -= 1
+            variant = subscriber.variant
+            variant.subscribers -= 1
+            if variant.subscribers == 0:
+                # Last viewer of this variant left: tear it down
+                del self.variants[variant.key]
+                logging.info(f"Camera {self.id}: stopped stream variant {variant.describe()}")
+
+    def generate_frames(self, params=None):
+        subscriber = self.open_stream(params)
+        try:
+            if not self.ensure():
+                logging.error(f"Camera {self.id} unavailable for streaming")
+                return
+
+            while True:
+                item = subscriber.next_frame(timeout=FRAME_WAIT_TIMEOUT)
+                if item is None:
+                    if self.shutdown_flag:
+                        logging.info(f"Shutdown detected during streaming on camera {self.id}")
+                        break
+                    if not self.ensure():
+                        logging.error(f"Camera {self.id} unavailable for streaming")
+                        break
+                    continue
 
-            with camera_lock:
-                if shutdown_flag:
-                    logging.info("Shutdown detected during streaming")
+                seq, _, frame = item
+                payload = subscriber.variant.encode(seq, frame)
+                yield mjpeg_part(payload)
+        finally:
+            self.close_stream(subscriber)
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "state": self.grabber.state,
+            "warmup_seconds": self.grabber.warmup_seconds,
+            "active_streams": self.active_streams,
+            "frames": self.grabber.seq,
+            "opens": self.opens,
+            "reopens": self.grabber.reopens,
+            "captures": self.captures,
+            "variants": [variant.describe() for variant in list(self.variants.values())],
+            "motion_gate": self.grabber.gate.stats() if self.grabber.gate else None,
+            "pipeline": self.pipeline.describe(),
+            "streams": self.grabber.subscriber_stats(),
+        }
+
+    def latest_frame(self):
+        """Newest buffered frame if it is recent enough, otherwise the next frame the grabber reads"""
+        item = self.grabber.ring.latest()
+        if item is not None and time.time() - item[1] <= SNAPSHOT_MAX_AGE:
+            return item
+        return self.grabber.wait_frame(self.grabber.seq, timeout=FRAME_WAIT_TIMEOUT)
+
+    def published_frame(self):
+        """Like latest_frame, but the grabber's published frame itself instead of a ring copy; read it, never write to it"""
+        item = self.grabber.latest()
+        if item is not None and time.time() - item[1] <= SNAPSHOT_MAX_AGE:
+            return item
+        return self.grabber.wait_frame(self.grabber.seq, timeout=FRAME_WAIT_TIMEOUT)
+
+    def snapshot_jpeg(self):
+        """JPEG bytes of the newest frame, or None if the camera is unavailable"""
+        if not self.ensure():
+            logging.error(f"Camera {self.id} unavailable for snapshot")
+            return None
+
+        item = self.latest_frame()
+        if item is None:
+            logging.error(f"Timed out waiting for a snapshot frame on camera {self.id}")
+            return None
+
+        seq, _, frame = item
+        return self.encode_cache.get(seq, frame)
+
+    def best_frame(self, count=CAPTURE_BEST_OF):
+        """Sharpest, best exposed of the newest `count` buffered frames, with the scores of every candidate.
+
+        Returns ((seq, timestamp, frame), quality), or (None, None) if no frame arrives. Candidates are
+        downscaled under the ring lock and scored outside it; only the winner is copied at full size.
+        Falls back to latest_frame() when nothing recent enough is buffered.
+        """
+        started = time.perf_counter()
+        now = time.time()
+        thumbnails = [entry for entry in self.grabber.ring.map_recent(count, thumbnail)
+                      if now - entry[1] <= CAPTURE_BEST_OF_WINDOW]
+        candidates = rank_frames(thumbnails)
+        # The winner may have been overwritten since scoring if the ring is small; take the runner-up then
+        item = next(filter(None, (self.grabber.ring.get(candidate["seq"]) for candidate in candidates)), None)
+        if item is None:
+            item = self.latest_frame()
+            if item is None:
+                return None, None
+            candidates = rank_frames([(item[0], item[1], thumbnail(item[2]))])
+        elapsed = time.perf_counter() - started
+        scoring_seconds.observe(elapsed, camera=self.id)
+        quality = {"chosen": item[0], "scoring_ms": round(elapsed * 1000, 3), "candidates": candidates}
+        return item, quality
+
+    def capture_image(self, best_of=CAPTURE_BEST_OF):
+        """Capture the best of the newest `best_of` frames into the capture store.
+
+        Returns its index record plus the frame scores under "quality", or None on failure.
+        """
+        if not self.ensure():
+            logging.error(f"Camera {self.id} unavailable for capture")
+            return None
+
+        item, quality = self.best_frame(best_of)
+        if item is None:
+            logging.error(f"Timed out waiting for a frame to capture on camera {self.id}")
+            return None
+
+        seq, timestamp, frame = item
+        payload = self.encode_cache.get(seq, frame)
+        record = dict(capture_store.add(self.id, payload, timestamp), quality=quality)
+        self.captures += 1
+        logging.info(f"Capture {record['id']} saved from camera {self.id} "
+                     f"(frame {seq}, best of {len(quality['candidates'])}, scored in {quality['scoring_ms']} ms)")
+
+        # Keep the legacy fixed-path file up to date for clients that read it directly
+        # Per process, since worker processes share the images folder
+        tmp_path = f"{self.image_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.image_path)
+        return record
+
+    def capture_burst(self, count, interval=0.0):
+        """Grab `count` consecutive frames at least `interval` seconds apart and encode them in parallel.
+
+        Returns a list of (seq, timestamp, future of JPEG bytes), shorter than `count` if the camera
+        stopped delivering frames part way, or None if the camera is unavailable.
+        """
+        # A private mailbox big enough for the whole burst, so no frame is dropped while we encode
+        subscriber = self.grabber.subscribe(capacity=count)
+        try:
+            if not self.ensure():
+                logging.error(f"Camera {self.id} unavailable for burst capture")
+                return None
+
+            frames = []
+            while len(frames) < count:
+                item = subscriber.next_frame(timeout=FRAME_WAIT_TIMEOUT)
+                if item is None:
+                    logging.error(f"Timed out waiting for burst frame {len(frames) + 1}/{count} on camera {self.id}")
                     break
-
-                success, frame = camera.read()
-                last_camera_use = time.time()
-                if not success:
-                    logging.warning("Frame grab failed, skipping...")  
+                seq, timestamp, frame = item
+                if frames and timestamp - frames[-1][1] < interval:
                     continue
+                frames.append((seq, timestamp, self.encode_cache.submit(seq, frame)))
+        finally:
+            subscriber.close()
+
+        self.captures += len(frames)
+        logging.info(f"Burst of {len(frames)} frames captured from camera {self.id}")
+        return frames
+
+    def shutdown(self):
+        with self.locked():
+            self.shutdown_flag = True
+            if self.grabber.is_running:
+                logging.info(f"Force-releasing camera {self.id} resources...")
+            self.grabber.stop()
+            return True
+
+# Camera registry, keyed by camera id (the device index as a string)
+cameras = {}
+default_camera_id = None
+
+def configure_source(devices=None, **options):
+    """Override frame source settings and (re)build the camera registry, e.g. from command line flags"""
+    global default_camera_id
+    source_options.update({key: value for key, value in options.items() if value is not None})
+    if not devices:
+        devices = CAMERA_DEVICES or [source_options["device"]]
+
+    for cam in cameras.values():
+        cam.shutdown()
+    cameras.clear()
+
+    # Shared memory frames were already processed by the capture process that published them
+    pipeline_config = [] if source_options["source"] == "shared" else parse_pipeline_config()
+
+    for index, device in enumerate(devices):
+        cam_id = str(device)
+        # The first camera keeps the original image path so existing clients are unaffected
+        image_path = IMAGE_PATH if index == 0 else os.path.join(IMAGE_FOLDER, f"captured_{cam_id}.jpg")
+        cameras[cam_id] = Camera(cam_id, dict(source_options, device=device), image_path, pipeline_config)
+    default_camera_id = str(devices[0])
+
+def get_camera(cam_id=None):
+    """Look up a camera by id (the default camera if None); raises KeyError for unknown ids"""
+    return cameras[default_camera_id if cam_id is None else str(cam_id)]
+
+def init_camera(cam_id=None):
+    """Open a camera and wait until it delivers frames; the grabber keeps the device"""
+    return get_camera(cam_id).ensure()
+
+def _ensure_camera(cam_id=None):
+    return get_camera(cam_id).ensure()
+
+def reopen_camera(cam_id=None):
+    get_camera(cam_id).reopen()
+    return jsonify({"message": "Camera re-enabled."})
 
-            _, buffer = cv2.imencode('.jpg', frame)
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n\r\n')
-    finally:
-        active_streams -= 1
-        if active_streams == 0:
-            _schedule_camera_shutdown()
-
-def capture_image():
-    if not _ensure_camera():
-        logging.error("Camera unavailable for capture")
-        return False
-
-    try:
-        with camera_lock:
-            success, frame = camera.read()
-            last_camera_use = time.time()
-            if success:
-                cv2.imwrite(IMAGE_PATH, frame)
-                logging.info(f"Image saved to {IMAGE_PATH}")
-            return success
-    finally:
-        if active_streams == 0:
-            _schedule_camera_shutdown()
-
-def _force_camera_reset():
-    global camera, last_camera_use
-    with camera_lock:
-        if camera:
-            camera.release()
-            camera = None
-        camera = init_camera()
-        last_camera_use = time.time()
-
-def _schedule_camera_shutdown():
-    def delayed_shutdown():
-        time.sleep(2)
-        _safe_camera_shutdown()
-    threading.Thread(target=delayed_shutdown, daemon=True).start()
-
-def _safe_camera_shutdown():
-    global camera, active_streams
-    with camera_lock:
-        if active_streams == 0 and camera and camera.isOpened():
-            logging.info("Shutting down camera with no active streams")
-            camera.release()
-            camera = None
-
-def shutdown_camera():
-    global camera, shutdown_flag
-    with camera_lock:
-        shutdown_flag = True
-        if camera and camera.isOpened():
-            logging.info("Force-releasing camera resources...")
-            camera.release()
-            camera = None
-        return True
+def generate_frames(cam_id=None, params=None):
+    return get_camera(cam_id).generate_frames(params)
+
+def stream_stats():
+    """Per-camera and per-client delivery counters for the currently connected streams"""
+    return {
+        "active_streams": sum(cam.active_streams for cam in cameras.values()),
+        "cameras": [cam.stats() for cam in cameras.values()],
+    }
+
+def snapshot_jpeg(cam_id=None):
+    return get_camera(cam_id).snapshot_jpeg()
+
+def capture_image(cam_id=None):
+    return get_camera(cam_id).capture_image()
+
+def shutdown_camera(cam_id=None):
+    """Force shutdown one camera, or every camera if no id is given"""
+    if cam_id is not None:
+        return get_camera(cam_id).shutdown()
+    for cam in cameras.values():
+        cam.shutdown()
+    return True
+
+def _collect_metrics():
+    """Per-camera values read from the registry on every /metrics scrape"""
+    per_camera = {
+        "camera_frames_total": ("counter", "Frames read from the capture device", lambda cam: cam.grabber.seq),
+        "camera_capture_fps": ("gauge", "Smoothed rate at which the device delivers frames",
+                               lambda cam: round(cam.grabber.fps, 2)),
+        "camera_active_streams": ("gauge", "Connected stream clients", lambda cam: cam.active_streams),
+        "camera_dropped_frames_total": ("counter", "Frames dropped because a stream client fell behind",
+                                        lambda cam: cam.grabber.frames_dropped),
+        "camera_opens_total": ("counter", "Times the capture device was opened", lambda cam: cam.opens),
+        "camera_reopens_total": ("counter", "Reopens after the device stopped delivering frames",
+                                 lambda cam: cam.grabber.reopens),
+        "camera_captures_total": ("counter", "Images captured", lambda cam: cam.captures),
+        "camera_encode_cache_hits_total": ("counter", "Encodes served from the shared encode cache",
+                                           lambda cam: cam.encode_cache.hits),
+        "camera_encode_cache_misses_total": ("counter", "Encodes submitted to the encode pool",
+                                             lambda cam: cam.encode_cache.misses),
+        "camera_motion_suppressed_total": ("counter", "Stream frames skipped because the scene was static",
+                                           lambda cam: cam.grabber.gate.suppressed if cam.grabber.gate else 0),
+    }
+    cams = list(cameras.values())
+    for name, (kind, help, value) in per_camera.items():
+        yield name, kind, help, [({"camera": cam.id}, value(cam)) for cam in cams]
+    yield "camera_up", "gauge", "1 if the camera is delivering frames", [
+        ({"camera": cam.id, "state": cam.grabber.state}, int(cam.grabber.is_running)) for cam in cams]
+
+metrics.register_collector(_collect_metrics)
+
+configure_source()
+
+def _stop_shared_frames():
+    # os._exit() skips atexit, which would leave the capture role's shared memory segments
+    # in /dev/shm; only a process that imported app.sharedframes can have published any
+    sharedframes = sys.modules.get("app.sharedframes")
+    if sharedframes is not None:
+        sharedframes.stop_publishing()
 
 def shutdown_server():
     shutdown_camera()
+    _stop_shared_frames()
     threading.Thread(target=lambda: (time.sleep(1), os._exit(0))).start()
     return jsonify({"message": "Server shutting down..."})
 
-def _cleanup_opencv_temp_files():
-    """Remove lingering OpenCV temp files to prevent buildup"""
-    while True:
-        time.sleep(600)  # Run every 10 minutes
-        try:
-            temp_dir = os.environ.get('TEMP') or tempfile.gettempdir()
-            now = time.time()
-            for fname in os.listdir(temp_dir):
-                if fname.lower().startswith('opencv') or fname.lower().endswith(('.dll', '.bin')):
-                    fpath = os.path.join(temp_dir, fname)
-                    if os.path.isfile(fpath) and now - os.path.getmtime(fpath) > 300:
-                        try:
-                            os.remove(fpath)
-                            logging.info(f"[Temp Cleanup] Deleted: {fpath}")
-                        except Exception as e:
-                            logging.warning(f"[Temp Cleanup] Could not delete {fpath}: {e}")
-        except Exception as e:
-            logging.error(f"[Temp Cleanup] Unexpected error: {e}")
-
-# Start cleanup thread once
-cleanup_thread = threading.Thread(target=_cleanup_opencv_temp_files, daemon=True)
-cleanup_thread.start()
-
 # Handle termination signals (e.g., ctrl + c, ctrl + x)
 def handle_exit_signal(signal, frame):
     logging.info("Received termination signal, shutting down...")
     shutdown_camera()
+    _stop_shared_frames()
     time.sleep(1)  # Give the shutdown a moment to complete
     os._exit(0)
 
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app.config import (
+    CAPTURE_FOLDER,
+    CAPTURE_CACHE_BYTES,
+    CAPTURE_INDEX_MEMORY,
+    CAPTURE_MAX_COUNT,
+    CAPTURE_MAX_AGE_HOURS,
+)
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+CAPTURE_ID_PATTERN = re.compile(r"^\d{8}T\d{9}-[0-9a-f]{6}$")
+# Retention is enforced at startup and after every this many captures added by this process
+PRUNE_EVERY = 100
+
+
+def content_etag(payload):
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+
+def new_capture_id(timestamp):
+    """Sortable unique id: UTC time to the millisecond plus a random suffix."""
+    millis = int(timestamp * 1000) % 1000
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(timestamp)) + f"{millis:03d}-{secrets.token_hex(3)}"
+
+
+def _index_line(record):
+    return (json.dumps(record, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+def _parse_record(line):
+    """Index record from one index.jsonl line, or None if it is malformed."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or not all(key in record for key in ("id", "timestamp", "camera")):
+        return None
+    return record
+
+
+class CaptureStore:
+    """Captured JPEGs stored under unique ids.
+
+    Files live in `folder` next to an append-only `index.jsonl` (id, timestamp, camera,
+    size). The newest `max_records` index records are kept in memory, older ones are
+    looked up in the index file, and the most recent payloads are kept in a size-bounded
+    in-memory LRU so fetching a recent capture does not read the disk. Captures beyond
+    `max_count` or older than `max_age` seconds are deleted and the index is compacted.
+
+    Several serving processes may share the folder (`run.py --role worker`): each line
+    is appended with a single O_APPEND write under a lock file that compaction also
+    takes, and lookups first read whatever other processes appended since the last lookup.
+    """
+
+    def __init__(self, folder, memory_limit, max_records=CAPTURE_INDEX_MEMORY, max_count=CAPTURE_MAX_COUNT,
+                 max_age=CAPTURE_MAX_AGE_HOURS * 3600):
+        self.folder = folder
+        self.index_path = os.path.join(folder, "index.jsonl")
+        self.lock_path = os.path.join(folder, "index.lock")
+        self.memory_limit = memory_limit
+        self.max_records = max(1, max_records)
+        self.max_count = max_count
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        # Set once records were dropped from _records, so it no longer holds the whole index
+        self._evicted = False
+        self._latest = {}
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        # Bytes of index.jsonl already read into _records, and the file they were read from
+        self._index_offset = 0
+        self._index_inode = None
+        self._added = 0
+        self.memory_hits = 0
+        self.disk_reads = 0
+        self.index_scans = 0
+        self.pruned = 0
+
+        os.makedirs(folder, exist_ok=True)
+        self.prune()
+        with self._lock:
+            self._load_index()
+        logging.info(f"Loaded {len(self._records)} recent captures from {self.index_path}")
+
+    @contextmanager
+    def _locked_index(self):
+        """Hold the cross-process lock on index.jsonl (appends and compaction)."""
+        with open(self.lock_path, 'a+') as handle:
+            if sys.platform == "win32":
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if sys.platform == "win32":
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _remember(self, record):
+        # Caller holds self._lock
+        self._records[record["id"]] = record
+        self._latest[record["camera"]] = record["id"]
+        while len(self._records) > self.max_records:
+            self._records.popitem(last=False)
+            self._evicted = True
+
+    def _load_index(self):
+        """Read index lines appended since the last call (by this or another process)."""
+        # Caller holds self._lock
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return
+        if stat.st_ino == self._index_inode and stat.st_size == self._index_offset:
+            return
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = None
+                if stat.st_ino == self._index_inode and 0 < self._index_offset <= stat.st_size:
+                    f.seek(self._index_offset - 1)
+                    data = f.read(stat.st_size - self._index_offset + 1)
+                    # Carry on after the last line read, if that still ends a line in this file
+                    data = data[1:] if data[:1] == b"\n" else None
+                if data is None:
+                    # Index was compacted, truncated or replaced: start over
+                    self._records.clear()
+                    self._latest.clear()
+                    self._evicted = False
+                    self._index_offset = 0
+                    self._index_inode = stat.st_ino
+                    f.seek(0)
+                    data = f.read(stat.st_size)
+        except OSError as e:
+            logging.warning(f"Could not read capture index {self.index_path}: {e}")
+            return
+        # Leave a partially written last line for the next call
+        complete = data.rfind(b"\n") + 1
+        self._index_offset += complete
+        for line in data[:complete].splitlines():
+            record = _parse_record(line)
+            if record is not None and record["id"] not in self._records:
+                self._remember(record)
+
+    def _read_index(self):
+        """Every record in index.jsonl, in file order."""
+        try:
+            with open(self.index_path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return []
+        if lines and not lines[-1].endswith(b"\n"):
+            # A partially written last line is not a record yet
+            lines.pop()
+        return [record for record in map(_parse_record, lines) if record is not None]
+
+    def _lookup(self, capture_id):
+        """Index record for a capture id: from memory, or by scanning the index for older captures."""
+        with self._lock:
+            self._load_index()
+            record = self._records.get(capture_id)
+            if record is not None or not self._evicted:
+                return record
+            self.index_scans += 1
+        needle = capture_id.encode('utf-8')
+        try:
+            with open(self.index_path, 'rb') as f:
+                for line in f:
+                    if needle in line:
+                        record = _parse_record(line)
+                        if record is not None and record["id"] == capture_id:
+                            return record
+        except OSError:
+            pass
+        return None
+
+    def path_for(self, capture_id):
+        return os.path.join(self.folder, f"{capture_id}.jpg")
+
+    def add(self, camera_id, payload, timestamp=None):
+        """Store a JPEG payload and return its index record."""
+        timestamp = timestamp or time.time()
+        record = {
+            "id": new_capture_id(timestamp),
+            "timestamp": round(timestamp, 3),
+            "camera": camera_id,
+            "size": len(payload),
+            "etag": content_etag(payload),
+        }
+        path = self.path_for(record["id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            with self._locked_index(), open(self.index_path, 'ab') as f:
+                f.write(_index_line(record))
+            self._remember(record)
+            self._cache_put(record["id"], payload)
+            self._added += 1
+            prune = self._added % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return record
+
+    def prune(self):
+        """Delete captures beyond `max_count` or older than `max_age` and compact the index; returns how many."""
+        if not (self.max_count or self.max_age):
+            return 0
+        with self._lock, self._locked_index():
+            records = self._read_index()
+            newest_first = sorted(records, key=lambda record: record["timestamp"], reverse=True)
+            cutoff = time.time() - self.max_age if self.max_age else None
+            expired = {
+                record["id"] for position, record in enumerate(newest_first)
+                if (self.max_count and position >= self.max_count)
+                or (cutoff is not None and record["timestamp"] < cutoff)
+            }
+            if not expired:
+                return 0
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.writelines(_index_line(record) for record in records if record["id"] not in expired)
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                logging.warning(f"Capture retention: could not compact {self.index_path}: {e}")
+                return 0
+
+            for capture_id in expired:
+                if capture_id in self._cache:
+                    self._cache_bytes -= len(self._cache.pop(capture_id))
+                if not isinstance(capture_id, str) or not CAPTURE_ID_PATTERN.match(capture_id):
+                    continue
+                try:
+                    os.remove(self.path_for(capture_id))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"Capture retention: could not delete {capture_id}: {e}")
+            self.pruned += len(expired)
+            # Picked up as a replaced index by the next lookup here and in other processes
+            self._load_index()
+        logging.info(f"Capture retention: deleted {len(expired)} captures, {len(records) - len(expired)} kept")
+        return len(expired)
+
+    def get(self, capture_id):
+        """Return (record, payload) for a capture id, or None if unknown."""
+        record = self._lookup(capture_id)
+        if record is None:
+            return None
+        with self._lock:
+            payload = self._cache.get(capture_id)
+            if payload is not None:
+                self._cache.move_to_end(capture_id)
+                self.memory_hits += 1
+                return record, payload
+
+        try:
+            with open(self.path_for(capture_id), 'rb') as f:
+                payload = f.read()
+        except OSError as e:
+            logging.warning(f"Capture {capture_id} is indexed but unreadable: {e}")
+            return None
+
+        with self._lock:
+            self.disk_reads += 1
+            # Records indexed before ETags were stored get one on first read
+            record.setdefault("etag", content_etag(payload))
+            self._cache_put(capture_id, payload)
+        return record, payload
+
+    def record(self, capture_id):
+        """Index record for a capture id, without loading the image."""
+        return self._lookup(capture_id)
+
+    def latest_record(self, camera_id):
+        """Index record of a camera's most recent capture, or None."""
+        with self._lock:
+            self._load_index()
+            capture_id = self._latest.get(camera_id)
+        return self._lookup(capture_id) if capture_id else None
+
+    def latest(self, camera_id):
+        """Return (record, payload) for a camera's most recent capture, or None."""
+        record = self.latest_record(camera_id)
+        return self.get(record["id"]) if record else None
+
+    def list(self, since=None, camera_id=None, limit=100):
+        """Index records newer than `since` (unix time), oldest first."""
+        def matches(record):
+            return ((since is None or record["timestamp"] > since)
+                    and (camera_id is None or record["camera"] == camera_id))
+
+        with self._lock:
+            self._load_index()
+            records = [record for record in self._records.values() if matches(record)]
+            # Whether memory holds every record the query can match
+            oldest = next(iter(self._records.values()), None)
+            complete = not self._evicted or (since is not None and oldest is not None and oldest["timestamp"] <= since)
+        if not complete and (not limit or len(records) < limit):
+            # The matching records may go back further than the ones kept in memory
+            with self._lock:
+                self.index_scans += 1
+            records = [record for record in self._read_index() if matches(record)]
+        # Another process's earlier captures can be indexed here after this one's own
+        records.sort(key=lambda record: record["timestamp"])
+        return records[-limit:] if limit else records
+
+    def _cache_put(self, capture_id, payload):
+        # Caller holds self._lock
+        if len(payload) > self.memory_limit:
+            return
+        if capture_id in self._cache:
+            self._cache_bytes -= len(self._cache.pop(capture_id))
+        self._cache[capture_id] = payload
+        self._cache_bytes += len(payload)
+        while self._cache_bytes > self.memory_limit:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+
+capture_store = CaptureStore(CAPTURE_FOLDER, CAPTURE_CACHE_BYTES)
@@ -0,0 +1,133 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from app import metrics
+from app.config import CLEANUP_MIN_INTERVAL, CLEANUP_PERIOD, CLEANUP_MAX_AGE
+
+runs = metrics.Counter("temp_cleanup_runs_total", "Temp file cleanup runs")
+scans = metrics.Counter("temp_cleanup_dir_scans_total", "Full listings of the temp directory")
+triggers = metrics.Counter("temp_cleanup_triggers_total", "Cleanup requests, including ones coalesced into a single run")
+deleted = metrics.Counter("temp_cleanup_files_deleted_total", "Stale OpenCV temp files deleted")
+freed = metrics.Counter("temp_cleanup_bytes_freed_total", "Bytes freed by deleting stale temp files")
+failures = metrics.Counter("temp_cleanup_failures_total", "Temp files that could not be deleted")
+run_seconds = metrics.Histogram("temp_cleanup_run_seconds", "Duration of a cleanup run")
+
+
+def is_candidate(name):
+    """Files OpenCV leaves behind in the temp directory."""
+    name = name.lower()
+    return name.startswith('opencv') or name.endswith(('.dll', '.bin'))
+
+
+class TempCleaner:
+    """Deletes stale OpenCV temp files from one background thread.
+
+    Requests only call trigger(), which never touches the disk; triggers arriving
+    within `min_interval` of the last run are coalesced into one later run, and a run
+    also happens every `period` seconds. The directory is only listed again when its
+    mtime changes (a file was added or removed); otherwise just the known candidate
+    files are checked.
+    """
+
+    def __init__(self, folder=None, min_interval=CLEANUP_MIN_INTERVAL, period=CLEANUP_PERIOD,
+                 max_age=CLEANUP_MAX_AGE):
+        self.folder = folder or os.environ.get('TEMP') or tempfile.gettempdir()
+        self.min_interval = min_interval
+        self.period = period
+        self.max_age = max_age
+        self._candidates = {}
+        self._dir_mtime = None
+        self._last_run = 0.0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def candidates(self):
+        return len(self._candidates)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="temp-cleanup", daemon=True)
+                self._thread.start()
+
+    def trigger(self):
+        """Ask for a cleanup soon; cheap enough to call on every request."""
+        triggers.inc()
+        self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.period)
+            # Rate limit: anything triggered before the interval is up is handled by one run
+            remaining = self._last_run + self.min_interval - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            self._wakeup.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"[Temp Cleanup] Unexpected error: {e}")
+
+    def _scan(self):
+        """Refresh the candidate list if the directory changed since the last listing."""
+        mtime = os.stat(self.folder).st_mtime
+        if mtime == self._dir_mtime:
+            return
+        scans.inc()
+        candidates = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                # Filter on the name first so only candidate files are stat'ed
+                if is_candidate(entry.name) and entry.is_file(follow_symlinks=False):
+                    candidates[entry.path] = entry.name
+        self._candidates = candidates
+        self._dir_mtime = mtime
+
+    def run_once(self):
+        """Delete candidate files older than max_age; returns how many were deleted."""
+        started = time.perf_counter()
+        self._last_run = time.monotonic()
+        runs.inc()
+        self._scan()
+
+        now = time.time()
+        removed = 0
+        for path in list(self._candidates):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            if now - stat.st_mtime <= self.max_age:
+                continue
+            try:
+                os.remove(path)
+                del self._candidates[path]
+                removed += 1
+                deleted.inc()
+                freed.inc(stat.st_size)
+                logging.info(f"[Temp Cleanup] Deleted: {path}")
+            except OSError as e:
+                # Usually still in use by another process; retried on the next run
+                failures.inc()
+                logging.warning(f"[Temp Cleanup] Could not delete {path}: {e}")
+
+        run_seconds.observe(time.perf_counter() - started)
+        return removed
+
+
+temp_cleaner = TempCleaner()
+
+
+def _collect_metrics():
+    yield "temp_cleanup_candidates", "gauge", "OpenCV temp files being tracked for cleanup", [
+        ({}, temp_cleaner.candidates)]
+
+
+metrics.register_collector(_collect_metrics)
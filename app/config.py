@@ -13,3 +13,106 @@ os.makedirs(IMAGE_FOLDER, exist_ok=True)
 
 IMAGE_FILENAME = "captured.jpg"
 IMAGE_PATH = os.path.join(IMAGE_FOLDER, IMAGE_FILENAME)
+
+# JPEG quality used for streamed and captured frames (0-100)
+JPEG_QUALITY = int(os.getenv("CAMERA_JPEG_QUALITY", "95"))
+
+# Frame source used by the camera grabber: "device", "file", "synthetic", or "shared" (frames published by a
+# capture process, see app/sharedframes.py)
+CAMERA_SOURCE = os.getenv("CAMERA_SOURCE", "device")
+CAMERA_DEVICE = int(os.getenv("CAMERA_DEVICE", "0"))
+# OpenCV capture backend for device sources ("any", "dshow", "msmf", "v4l2", "avfoundation")
+CAMERA_BACKEND = os.getenv("CAMERA_BACKEND", "dshow" if sys.platform == "win32" else "any")
+# Video file, image directory or glob pattern replayed by the "file" source
+CAMERA_SOURCE_PATH = os.getenv("CAMERA_SOURCE_PATH", "")
+# Frame rate for file/synthetic sources (0 = use the file's own rate)
+CAMERA_FPS = float(os.getenv("CAMERA_FPS", "0"))
+# Requested frame size (0 = device/file default, 640x480 for synthetic)
+CAMERA_WIDTH = int(os.getenv("CAMERA_WIDTH", "0"))
+CAMERA_HEIGHT = int(os.getenv("CAMERA_HEIGHT", "0"))
+
+# Number of recent frames the grabber keeps in its preallocated ring buffer
+FRAME_RING_SIZE = int(os.getenv("CAMERA_FRAME_RING_SIZE", "8"))
+# A buffered frame younger than this (in seconds) is used for snapshots/captures without waiting
+SNAPSHOT_MAX_AGE = float(os.getenv("CAMERA_SNAPSHOT_MAX_AGE", "0.1"))
+
+# Comma-separated device indexes to open as separate cameras, e.g. "0,1,2" (default: CAMERA_DEVICE only)
+CAMERA_DEVICES = [int(index) for index in os.getenv("CAMERA_DEVICES", "").split(",") if index.strip()]
+
+# Close a camera nobody is streaming from after it has been idle this long (in seconds)
+CAMERA_IDLE_TIMEOUT = float(os.getenv("CAMERA_IDLE_TIMEOUT", "60"))
+# Open cameras at startup and never close them while the server runs
+CAMERA_KEEP_WARM = os.getenv("CAMERA_KEEP_WARM", "0").lower() in ("1", "true", "yes")
+
+# Every capture is stored here under a unique id, with an index.jsonl of timestamp/camera/size
+CAPTURE_FOLDER = os.path.join(IMAGE_FOLDER, "captures")
+# Recent capture JPEGs kept in memory so fetching them does not hit the disk (in bytes)
+CAPTURE_CACHE_BYTES = int(os.getenv("CAPTURE_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Newest index records kept in memory; older captures are looked up in index.jsonl
+CAPTURE_INDEX_MEMORY = int(os.getenv("CAPTURE_INDEX_MEMORY", "2000"))
+# Retention: delete the oldest captures beyond this many or older than this (hours); 0 disables
+CAPTURE_MAX_COUNT = int(os.getenv("CAPTURE_MAX_COUNT", "5000"))
+CAPTURE_MAX_AGE_HOURS = float(os.getenv("CAPTURE_MAX_AGE_HOURS", "0"))
+
+# JPEG encoder backend: "opencv", or "turbojpeg"/"simplejpeg" when those packages are installed
+JPEG_ENCODER = os.getenv("CAMERA_JPEG_ENCODER", "opencv")
+# Encode worker pool size (0 = one per CPU core) and kind ("thread" or "process")
+ENCODE_WORKERS = int(os.getenv("CAMERA_ENCODE_WORKERS", "0"))
+ENCODE_POOL = os.getenv("CAMERA_ENCODE_POOL", "thread")
+
+# Skip encoding/sending stream frames when the scene has not changed (off by default)
+MOTION_GATE = os.getenv("CAMERA_MOTION_GATE", "0").lower() in ("1", "true", "yes")
+# Fraction of sampled pixels that must change for a frame to count as different
+MOTION_THRESHOLD = float(os.getenv("CAMERA_MOTION_THRESHOLD", "0.005"))
+# Per-pixel brightness difference (0-255) that counts as a change
+MOTION_PIXEL_THRESHOLD = int(os.getenv("CAMERA_MOTION_PIXEL_THRESHOLD", "12"))
+# Send a frame at least this often (in seconds) even when nothing changes
+MOTION_KEEPALIVE = float(os.getenv("CAMERA_MOTION_KEEPALIVE", "5"))
+
+# POST /capture scores this many of the newest buffered frames (at most the ring size) for sharpness
+# and exposure and saves the best one; frames older than the window (in seconds) are not considered
+CAPTURE_BEST_OF = int(os.getenv("CAMERA_CAPTURE_BEST_OF", "5"))
+CAPTURE_BEST_OF_WINDOW = float(os.getenv("CAMERA_CAPTURE_BEST_OF_WINDOW", "0.5"))
+
+# Upper limits for POST /capture/burst
+BURST_MAX_FRAMES = int(os.getenv("CAMERA_BURST_MAX_FRAMES", "30"))
+BURST_MAX_INTERVAL_MS = int(os.getenv("CAMERA_BURST_MAX_INTERVAL_MS", "2000"))
+
+# Segmented recording to disk
+RECORDING_FOLDER = os.getenv("CAMERA_RECORDING_FOLDER", os.path.join(BASE_PATH, "recordings"))
+RECORDING_SEGMENT_SECONDS = int(os.getenv("CAMERA_RECORDING_SEGMENT_SECONDS", "300"))
+RECORDING_CODEC = os.getenv("CAMERA_RECORDING_CODEC", "MJPG")
+# Frames buffered between the grabber and the writer thread before frames are dropped
+RECORDING_QUEUE_SIZE = int(os.getenv("CAMERA_RECORDING_QUEUE_SIZE", "60"))
+# "oldest" drops the oldest queued frame when the writer falls behind, "newest" drops incoming frames
+RECORDING_DROP_POLICY = os.getenv("CAMERA_RECORDING_DROP_POLICY", "newest")
+# Retention: delete the oldest finished segments beyond this total size (MB) or age (hours); 0 disables
+RECORDING_MAX_MB = int(os.getenv("CAMERA_RECORDING_MAX_MB", "2048"))
+RECORDING_MAX_AGE_HOURS = float(os.getenv("CAMERA_RECORDING_MAX_AGE_HOURS", "72"))
+
+# Open cameras in the background as soon as the app is created, instead of on the first request
+CAMERA_WARM_START = os.getenv("CAMERA_WARM_START", "1").lower() in ("1", "true", "yes")
+
+# OpenCV temp file cleanup: minimum seconds between runs, periodic run interval, and minimum file age
+CLEANUP_MIN_INTERVAL = float(os.getenv("CAMERA_CLEANUP_MIN_INTERVAL", "60"))
+CLEANUP_PERIOD = float(os.getenv("CAMERA_CLEANUP_PERIOD", "600"))
+CLEANUP_MAX_AGE = float(os.getenv("CAMERA_CLEANUP_MAX_AGE", "300"))
+
+# Logging: "text" or "json" lines, queue size, and per-message rate limit (records per interval)
+LOG_FORMAT = os.getenv("CAMERA_LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("CAMERA_LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_LIMIT = int(os.getenv("CAMERA_LOG_RATE_LIMIT", "5"))
+LOG_RATE_INTERVAL = float(os.getenv("CAMERA_LOG_RATE_INTERVAL", "10"))
+
+# Unix socket serving raw frames to local machine consumers (disabled when empty)
+RAW_FRAME_SOCKET = os.getenv("CAMERA_RAW_FRAME_SOCKET", "")
+
+# Per-frame processing stages: a JSON list such as [{"stage": "rotate", "angle": 90}, {"stage": "timestamp"}],
+# or the path of a JSON file containing one
+PROCESSING_PIPELINE = os.getenv("CAMERA_PIPELINE", "")
+
+# Shared memory frame ring published by `run.py --role capture` and read by `--role worker` processes:
+# segment name prefix (the camera id is appended), frames kept, and the largest frame in bytes
+SHARED_FRAMES_PREFIX = os.getenv("CAMERA_SHARED_FRAMES_PREFIX", "camera_frames_")
+SHARED_FRAMES_SLOTS = int(os.getenv("CAMERA_SHARED_FRAMES_SLOTS", "4"))
+SHARED_FRAMES_MAX_BYTES = int(os.getenv("CAMERA_SHARED_FRAMES_MAX_BYTES", str(1920 * 1080 * 3)))
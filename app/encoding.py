@@ -0,0 +1,311 @@
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+from app import metrics
+from app.config import JPEG_QUALITY, JPEG_ENCODER, ENCODE_WORKERS, ENCODE_POOL
+from app.utils import lazy_import
+
+
+class JPEGEncoder:
+    """A JPEG library behind a common interface, so alternatives can be swapped in and benchmarked."""
+
+    name = "base"
+
+    def encode(self, frame, quality):
+        """Encode a BGR uint8 frame, returning JPEG bytes."""
+        raise NotImplementedError
+
+
+class OpenCVEncoder(JPEGEncoder):
+    name = "opencv"
+
+    def __init__(self):
+        # Loaded up front, so the warm start pays for the import rather than the first frame
+        lazy_import("cv2")
+
+    def encode(self, frame, quality):
+        cv2 = lazy_import("cv2")
+        success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not success:
+            raise RuntimeError("JPEG encoding failed")
+        return buffer.tobytes()
+
+
+class TurboJPEGEncoder(JPEGEncoder):
+    """libjpeg-turbo through the optional PyTurboJPEG package."""
+
+    name = "turbojpeg"
+
+    def __init__(self):
+        from turbojpeg import TurboJPEG
+        self._jpeg = TurboJPEG()
+
+    def encode(self, frame, quality):
+        return self._jpeg.encode(frame, quality=int(quality))
+
+
+class SimpleJPEGEncoder(JPEGEncoder):
+    """libjpeg-turbo through the optional simplejpeg package."""
+
+    name = "simplejpeg"
+
+    def __init__(self):
+        import simplejpeg
+        self._simplejpeg = simplejpeg
+
+    def encode(self, frame, quality):
+        if not frame.flags.c_contiguous:
+            frame = frame.copy()
+        return self._simplejpeg.encode_jpeg(frame, quality=int(quality), colorspace='BGR')
+
+
+ENCODERS = {encoder.name: encoder for encoder in (OpenCVEncoder, TurboJPEGEncoder, SimpleJPEGEncoder)}
+
+_encoders = {}
+
+
+def get_encoder(name):
+    """Shared encoder instance by name, falling back to OpenCV if its library is not installed."""
+    encoder = _encoders.get(name)
+    if encoder is None:
+        try:
+            encoder = ENCODERS[name]()
+        except (KeyError, ImportError, OSError, RuntimeError) as e:
+            logging.warning(f"JPEG encoder '{name}' unavailable ({e}), using opencv")
+            encoder = _encoders.get("opencv") or OpenCVEncoder()
+        _encoders[name] = encoder
+    return encoder
+
+
+def available_encoders():
+    """Names of the encoders whose libraries can be loaded here."""
+    names = []
+    for name, encoder in ENCODERS.items():
+        try:
+            encoder()
+            names.append(name)
+        except (ImportError, OSError, RuntimeError):
+            pass
+    return names
+
+
+def encode_jpeg(frame, quality=JPEG_QUALITY, size=None, encoder=None):
+    """Encode a BGR frame as JPEG bytes, optionally resizing it to `size` (width, height) first."""
+    if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+        cv2 = lazy_import("cv2")
+        frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+    encoder = get_encoder(encoder or encoding_options["encoder"])
+    with metrics.encode_seconds.time(encoder=encoder.name):
+        return encoder.encode(frame, quality)
+
+
+# Encoder backend and worker pool settings; defaults come from app.config and can be overridden by run.py
+encoding_options = {
+    "encoder": JPEG_ENCODER,
+    "workers": ENCODE_WORKERS or os.cpu_count() or 1,
+    "pool": ENCODE_POOL,
+}
+
+
+class EncodePool:
+    """Dedicated encode stage: a thread or process pool sized to the core count.
+
+    OpenCV and the libjpeg-turbo bindings release the GIL while encoding, so the thread
+    pool already uses every core; the process pool trades a frame copy per job for full
+    isolation from the request threads.
+    """
+
+    def __init__(self, workers, kind="thread", encoder=None):
+        self.workers = workers
+        self.kind = kind
+        self.encoder = encoder
+        self._lock = threading.Lock()
+        self.pending = 0
+        if kind == "process":
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+
+    @property
+    def saturated(self):
+        """True when more jobs are queued than workers can start, so speculative work should be skipped."""
+        return self.pending >= 2 * self.workers
+
+    def submit(self, frame, quality, size):
+        with self._lock:
+            self.pending += 1
+        submitted = time.perf_counter()
+        future = self._executor.submit(encode_jpeg, frame, quality, size, self.encoder or encoding_options["encoder"])
+        future.add_done_callback(lambda future: self._done(submitted))
+        return future
+
+    def _done(self, submitted):
+        metrics.encode_job_seconds.observe(time.perf_counter() - submitted)
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EncodePool(encoding_options["workers"], encoding_options["pool"])
+            logging.info(f"Encode pool: {_pool.workers} {_pool.kind} workers, "
+                         f"encoder {get_encoder(encoding_options['encoder']).name}")
+        return _pool
+
+
+def configure_encoding(**options):
+    """Override encoder settings, e.g. from command line flags; restarts the pool if it was running"""
+    global _pool
+    encoding_options.update({key: value for key, value in options.items() if value})
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+class EncodeCache:
+    """Encoded JPEG payloads keyed by (frame seq, quality, size).
+
+    The first caller that asks for a key submits the encode to the pool; concurrent and
+    later callers wait on the same future and reuse the same bytes object. Entries for
+    frames older than the last `max_frames` sequence numbers are evicted as new frames
+    arrive.
+    """
+
+    def __init__(self, max_frames=4):
+        self.max_frames = max_frames
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, seq, frame, quality=JPEG_QUALITY, size=None):
+        """Future for the encoded payload, starting the encode if nobody has yet."""
+        key = (seq, int(quality), tuple(size) if size else None)
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self.hits += 1
+                return future
+            self.misses += 1
+            future = get_pool().submit(frame, quality, size)
+            self._entries[key] = future
+            self._evict(seq)
+        future.add_done_callback(lambda f: self._forget_failed(key, f))
+        return future
+
+    def get(self, seq, frame, quality=JPEG_QUALITY, size=None):
+        return self.submit(seq, frame, quality, size).result()
+
+    def prefetch(self, seq, frame, quality=JPEG_QUALITY, size=None):
+        """Start encoding ahead of demand, unless the pool is already backed up."""
+        if not get_pool().saturated:
+            self.submit(seq, frame, quality, size)
+
+    def _forget_failed(self, key, future):
+        if future.cancelled() or future.exception() is not None:
+            logging.error(f"Failed to encode frame {key[0]}: {future.exception() if not future.cancelled() else 'cancelled'}")
+            with self._lock:
+                if self._entries.get(key) is future:
+                    del self._entries[key]
+
+    def _evict(self, newest_seq):
+        oldest_kept = newest_seq - self.max_frames
+        for key in [key for key in self._entries if key[0] <= oldest_kept]:
+            del self._entries[key]
+
+def parse_variant_args(args):
+    """Validate width/height/fps/quality query parameters; raises ValueError on bad input."""
+    limits = {
+        "width": (int, 16, 7680),
+        "height": (int, 16, 4320),
+        "fps": (float, 0.1, 120),
+        "quality": (int, 1, 100),
+    }
+    params = {}
+    for name, (kind, low, high) in limits.items():
+        raw = args.get(name)
+        if raw in (None, ""):
+            continue
+        try:
+            value = kind(raw)
+        except ValueError:
+            raise ValueError(f"'{name}' must be a number")
+        if not low <= value <= high:
+            raise ValueError(f"'{name}' must be between {low} and {high}")
+        params[name] = value
+    return params
+
+
+class StreamVariant:
+    """Output size, frame rate and JPEG quality shared by every subscriber asking for the same stream.
+
+    The grabber asks each variant once per published frame whether it wants it, so all
+    subscribers of a variant receive the same frames and share one resize + encode each.
+    """
+
+    def __init__(self, cache, width=None, height=None, fps=None, quality=JPEG_QUALITY):
+        self.cache = cache
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.quality = quality
+        self.key = (width, height, fps, quality)
+        self.subscribers = 0
+        self._interval = 1.0 / fps if fps else 0
+        self._next_due = 0.0
+
+    def accept(self, item):
+        """Frame-rate gate, called from the grabber thread for every published (seq, timestamp, frame).
+
+        Accepted frames are handed to the encode pool straight away, so encoding overlaps
+        the capture of the next frame instead of waiting for a subscriber to ask.
+        """
+        seq, timestamp, frame = item
+        if self._interval:
+            # Allow a little jitter so a 30 fps source split to 10 fps does not drift to 7.5
+            if timestamp < self._next_due - self._interval / 4:
+                return False
+            self._next_due = max(self._next_due + self._interval, timestamp)
+        self.cache.prefetch(seq, frame, self.quality, self.output_size(frame))
+        return True
+
+    def output_size(self, frame):
+        """Target (width, height) for this frame, or None to keep it as is. Never upscales."""
+        frame_height, frame_width = frame.shape[:2]
+        width, height = self.width, self.height
+        if width and not height:
+            height = round(frame_height * width / frame_width)
+        elif height and not width:
+            width = round(frame_width * height / frame_height)
+        if not width or (width >= frame_width and height >= frame_height):
+            return None
+        return min(width, frame_width), min(height, frame_height)
+
+    def submit(self, seq, frame):
+        """Future for this variant's encoding of a frame."""
+        return self.cache.submit(seq, frame, self.quality, self.output_size(frame))
+
+    def encode(self, seq, frame):
+        return self.submit(seq, frame).result()
+
+    def describe(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "quality": self.quality,
+            "subscribers": self.subscribers,
+        }
@@ -0,0 +1,461 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+from app import metrics
+
+_subscriber_ids = itertools.count(1)
+
+
+class Subscriber:
+    """A consumer of frames published by a FrameGrabber.
+
+    Each subscriber has a bounded mailbox; when it is full the oldest frame is dropped,
+    so a slow consumer skips straight to the newest frame instead of building a backlog.
+    With `drop="newest"` the incoming frame is discarded instead, keeping the queued run
+    of frames contiguous.
+    """
+
+    def __init__(self, grabber, capacity=1, variant=None, drop="oldest", stream=True):
+        self.id = next(_subscriber_ids)
+        self.grabber = grabber
+        self.variant = variant
+        self.drop = drop
+        # Drops of stream clients also count towards the grabber's frames_dropped
+        self.stream = stream
+        self.last_seq = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.created_at = time.time()
+        self._mailbox = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._woken = False
+
+    def deliver(self, item):
+        """Called from the grabber thread with each new (seq, timestamp, frame)."""
+        with self._cond:
+            if len(self._mailbox) == self._mailbox.maxlen:
+                self.frames_dropped += 1
+                if self.stream:
+                    self.grabber.frames_dropped += 1
+                if self.drop == "newest":
+                    return
+            self._mailbox.append(item)
+            self._cond.notify()
+
+    @property
+    def queued(self):
+        """Frames waiting in the mailbox."""
+        return len(self._mailbox)
+
+    def next_frame(self, timeout=1.0):
+        """Block until a frame is in the mailbox, or return None after `timeout`."""
+        with self._cond:
+            if not self._mailbox:
+                self._cond.wait_for(lambda: self._mailbox or self._closed or self._woken, timeout)
+            self._woken = False
+            if not self._mailbox:
+                return None
+            item = self._mailbox.popleft()
+            self.last_seq = item[0]
+            self.frames_delivered += 1
+            return item
+
+    def wake(self):
+        """Wake a consumer blocked in next_frame() without giving it a frame."""
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "connected_seconds": round(time.time() - self.created_at, 1),
+            "frames_delivered": self.frames_delivered,
+            "frames_dropped": self.frames_dropped,
+            "last_seq": self.last_seq,
+            "variant": self.variant.describe() if self.variant is not None else None,
+        }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._mailbox.clear()
+            self._cond.notify_all()
+        self.grabber.unsubscribe(self)
+
+
+class FrameRing:
+    """The most recent frames, copied into a fixed set of preallocated buffers."""
+
+    def __init__(self, capacity=8):
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._buffers = None
+        self._seqs = [0] * self.capacity
+        self._timestamps = [0.0] * self.capacity
+        self._newest = -1
+
+    def push(self, seq, timestamp, frame):
+        with self._lock:
+            if self._buffers is None or self._buffers.shape[1:] != frame.shape or self._buffers.dtype != frame.dtype:
+                import numpy as np
+
+                # (Re)allocate once per frame geometry, never per frame
+                self._buffers = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+                self._seqs = [0] * self.capacity
+                self._newest = -1
+            slot = (self._newest + 1) % self.capacity
+            self._buffers[slot][...] = frame
+            self._seqs[slot] = seq
+            self._timestamps[slot] = timestamp
+            self._newest = slot
+
+    def latest(self):
+        """Return a copy of the newest frame as (seq, timestamp, frame), or None if empty."""
+        frames = self.recent(1)
+        return frames[0] if frames else None
+
+    def recent(self, count):
+        """Return copies of up to `count` buffered frames, newest first."""
+        with self._lock:
+            if self._newest < 0:
+                return []
+            frames = []
+            for i in range(min(count, self.capacity)):
+                slot = (self._newest - i) % self.capacity
+                if not self._seqs[slot]:
+                    break
+                frames.append((self._seqs[slot], self._timestamps[slot], self._buffers[slot].copy()))
+            return frames
+
+    def map_recent(self, count, fn):
+        """Return (seq, timestamp, fn(frame)) for up to `count` buffered frames, newest first.
+
+        `fn` runs under the ring lock on the buffer itself, so it must be quick and must
+        not keep a reference to the frame; it saves copying frames only to inspect them.
+        """
+        with self._lock:
+            if self._newest < 0:
+                return []
+            results = []
+            for i in range(min(count, self.capacity)):
+                slot = (self._newest - i) % self.capacity
+                if not self._seqs[slot]:
+                    break
+                results.append((self._seqs[slot], self._timestamps[slot], fn(self._buffers[slot])))
+            return results
+
+    def get(self, seq):
+        """Return a copy of the frame with sequence number `seq` as (seq, timestamp, frame), or None if overwritten."""
+        with self._lock:
+            if seq in self._seqs:
+                slot = self._seqs.index(seq)
+                return seq, self._timestamps[slot], self._buffers[slot].copy()
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._seqs = [0] * self.capacity
+            self._newest = -1
+
+
+# Camera lifecycle states, driven by FrameGrabber's supervisor thread
+CLOSED = "closed"        # device released
+OPENING = "opening"      # device opened, waiting for a stable frame
+WARM = "warm"            # reading frames, nobody streaming
+STREAMING = "streaming"  # reading frames for at least one subscriber
+DRAINING = "draining"    # releasing the device
+
+# Consecutive read failures after which the device is considered lost and reopened
+MAX_READ_FAILURES = 100
+
+
+class FrameGrabber:
+    """Owns one capture device and publishes every frame it reads to all subscribers.
+
+    A single supervisor thread opens the device on demand, warms it up until frames
+    are stable, reads and publishes frames, and closes the device again once it has
+    been idle for `idle_timeout` seconds (never, if `keep_warm` is set). Consumers call
+    start() to make sure it is open; back-to-back uses never pay the open cost.
+    """
+
+    def __init__(self, open_capture, name="camera0", ring_size=8, idle_timeout=60, keep_warm=False,
+                 warmup_timeout=3.0, stable_frames=3, stable_threshold=2.0, gate=None, pipeline=None):
+        self.name = name
+        # Optional processing chain applied to every frame before it is buffered or published
+        self.pipeline = pipeline
+        # Optional change detector; frames it rejects are not delivered to stream variants
+        self.gate = gate
+        self._open_capture = open_capture
+        self.ring = FrameRing(ring_size)
+        self.idle_timeout = idle_timeout
+        self.keep_warm = keep_warm
+        self.warmup_timeout = warmup_timeout
+        self.stable_frames = stable_frames
+        self.stable_threshold = stable_threshold
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._wanted = False
+        self._subscribers = set()
+        self._listeners = []
+        self.state = CLOSED
+        self.reopens = 0
+        self.warmup_seconds = None
+        # Whether the last attempt to open the device got it delivering frames (None before the first)
+        self.available = None
+        # Frames dropped from stream subscribers' mailboxes over the grabber's lifetime
+        self.frames_dropped = 0
+        # Smoothed rate at which the device delivers frames
+        self.fps = 0.0
+
+        # Latest published frame
+        self.seq = 0
+        self.frame = None
+        self.timestamp = 0.0
+        self.last_use = 0
+
+    @property
+    def is_running(self):
+        return self.state in (WARM, STREAMING)
+
+    @property
+    def subscriber_count(self):
+        with self._cond:
+            return len(self._subscribers)
+
+    def request(self):
+        """Ask the supervisor to open the device without waiting for it."""
+        with self._cond:
+            self.last_use = time.time()
+            self._wanted = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._supervise, name=f"grabber-{self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def start(self, timeout=10.0):
+        """Open the device if needed and wait until it delivers stable frames; False if it could not be opened."""
+        self.request()
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.is_running or (self.state == CLOSED and not self._wanted), timeout)
+            return self.is_running
+
+    def stop(self, timeout=5.0):
+        """Release the device now, regardless of subscribers or the keep-warm policy."""
+        with self._cond:
+            self._wanted = False
+            subscribers = list(self._subscribers)
+            self._cond.notify_all()
+        for subscriber in subscribers:
+            subscriber.wake()
+
+        if self._thread is not threading.current_thread():
+            with self._cond:
+                self._cond.wait_for(lambda: self.state == CLOSED, timeout)
+
+    def subscribe(self, capacity=1, variant=None, drop="oldest", stream=True):
+        """Register a consumer. `variant`, if given, decides via accept(item) which frames it gets.
+
+        Pass stream=False for consumers other than stream clients (e.g. the recorder), so
+        their drops are not counted in frames_dropped.
+        """
+        subscriber = Subscriber(self, capacity, variant, drop, stream)
+        with self._cond:
+            subscriber.last_seq = self.seq
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._cond:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                # Idle time counts from when the last subscriber left
+                self.last_use = time.time()
+            return len(self._subscribers)
+
+    def add_listener(self, callback):
+        """Call `callback(item)` from the grabber thread for every published frame."""
+        with self._cond:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def subscriber_stats(self):
+        with self._cond:
+            subscribers = list(self._subscribers)
+        return [subscriber.stats() for subscriber in subscribers]
+
+    def wait_frame(self, after_seq=0, timeout=1.0):
+        """Return (seq, timestamp, frame) for the first frame newer than `after_seq`."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.seq <= after_seq:
+                remaining = deadline - time.monotonic()
+                if not self._wanted or remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            self.last_use = time.time()
+            return self.seq, self.timestamp, self.frame
+
+    def latest(self):
+        """The last published (seq, timestamp, frame), or None; the frame itself, not a copy.
+
+        Frames are never written to once published, so it is safe to read without copying.
+        """
+        with self._cond:
+            return (self.seq, self.timestamp, self.frame) if self.frame is not None else None
+
+    def _set_state(self, state):
+        # Caller holds self._cond
+        if state != self.state:
+            logging.info(f"Camera {self.name}: {self.state} -> {state}", extra={"camera": self.name, "state": state})
+            self.state = state
+            self._cond.notify_all()
+
+    def _supervise(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._wanted)
+                self._set_state(OPENING)
+
+            started = time.monotonic()
+            capture = None
+            failed = False
+            try:
+                capture = self._open_capture()
+                if capture is None:
+                    failed = True
+                elif self._warm_up(capture):
+                    self.warmup_seconds = round(time.monotonic() - started, 3)
+                    logging.info(f"Camera {self.name} warm after {self.warmup_seconds}s")
+                    self.available = True
+                    self.ring.clear()
+                    self._read_frames(capture)
+                elif self._wanted:
+                    logging.error(f"Camera {self.name} never produced a frame during warmup")
+                    failed = True
+            except Exception:
+                # A failing read, stage or listener must not end the thread: request() would never restart it
+                logging.exception(f"Camera {self.name} capture loop failed")
+                failed = True
+
+            with self._cond:
+                self._set_state(DRAINING)
+                subscribers = list(self._subscribers)
+                if failed:
+                    # Open, warmup or read failed: do not retry until someone asks again
+                    self._wanted = False
+                    self.available = False
+            for subscriber in subscribers:
+                subscriber.wake()
+
+            if capture is not None:
+                logging.info(f"Releasing capture device for {self.name}")
+                try:
+                    capture.release()
+                except Exception:
+                    logging.exception(f"Releasing capture device for {self.name} failed")
+
+            with self._cond:
+                self._set_state(CLOSED)
+
+    def _warm_up(self, capture):
+        """Read frames until the picture is stable (auto exposure settled) or the warmup times out."""
+        deadline = time.monotonic() + self.warmup_timeout
+        previous = None
+        stable = 0
+        got_frame = False
+        while self._wanted and time.monotonic() < deadline:
+            success, frame = capture.read()
+            if not success:
+                time.sleep(0.01)
+                continue
+            got_frame = True
+            brightness = float(frame[::4, ::4].mean())
+            if previous is not None and abs(brightness - previous) < self.stable_threshold:
+                stable += 1
+                if stable >= self.stable_frames:
+                    return True
+            else:
+                stable = 0
+            previous = brightness
+        # Accept a camera that delivers frames but never settles completely
+        return got_frame and self._wanted
+
+    def _should_close(self):
+        # Caller holds self._cond
+        if not self._wanted:
+            return True
+        if self._subscribers or self.keep_warm:
+            return False
+        if time.time() - self.last_use > self.idle_timeout:
+            logging.info(f"Camera {self.name} idle for {self.idle_timeout}s, closing")
+            self._wanted = False
+            return True
+        return False
+
+    def _read_frames(self, capture):
+        failures = 0
+        while True:
+            with self._cond:
+                if self._should_close():
+                    return
+                self._set_state(STREAMING if self._subscribers else WARM)
+
+            with metrics.frame_read_seconds.time(camera=self.name):
+                success, frame = capture.read()
+            if not success:
+                failures += 1
+                if failures == 1 or failures % 100 == 0:
+                    logging.warning(f"Frame grab failed on {self.name} ({failures} consecutive), skipping...",
+                                    extra={"camera": self.name, "failures": failures})
+                if failures >= MAX_READ_FAILURES:
+                    logging.error(f"Camera {self.name} stopped delivering frames, reopening")
+                    self.reopens += 1
+                    return
+                time.sleep(0.01)
+                continue
+            failures = 0
+
+            timestamp = time.time()
+            if self.pipeline is not None:
+                frame = self.pipeline.process(frame, timestamp)
+
+            # Only this thread advances seq, so the ring can be filled before publishing
+            item = (self.seq + 1, timestamp, frame)
+            self.ring.push(*item)
+            if self.timestamp and item[1] > self.timestamp:
+                rate = 1.0 / (item[1] - self.timestamp)
+                self.fps = self.fps + 0.1 * (rate - self.fps) if self.fps else rate
+
+            with self._cond:
+                self.seq, self.timestamp, self.frame = item
+                subscribers = list(self._subscribers)
+                listeners = list(self._listeners)
+                self._cond.notify_all()
+
+            # The change gate and each variant's frame-rate gate are consulted once per frame,
+            # not once per subscriber
+            changed = self.gate is None or self.gate.check(frame, item[1])
+            accepted = {}
+            for subscriber in subscribers:
+                variant = subscriber.variant
+                if variant is not None:
+                    if not changed:
+                        continue
+                    if variant not in accepted:
+                        accepted[variant] = variant.accept(item)
+                    if not accepted[variant]:
+                        continue
+                subscriber.deliver(item)
+            for callback in listeners:
+                callback(item)
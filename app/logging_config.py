@@ -31,13 +31,20 @@
 #     logging.getLogger(__name__).info("Logging setup complete.")
 
 # app/logging_config.py
+import atexit
+import copy
+import json
 import logging
+import queue
 import sys
 import os
 import io
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 
+from app import metrics
+from app.config import LOG_FORMAT, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_INTERVAL
+
 # def setup_logging():
 #     # Ensure stdout uses UTF-8 to support Unicode output (e.g., emojis)
 #     if sys.stdout.encoding.lower() != 'utf-8':
@@ -78,6 +85,144 @@ from pathlib import Path
 #     logger.info("Logging setup complete.")
 #     logger.info(f"Logs are being written to: {log_file}")
 
+# Attributes every LogRecord has; anything else was passed as a structured field via `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "key"}
+
+
+def structured_fields(record):
+    return {name: value for name, value in vars(record).items() if name not in _RECORD_ATTRIBUTES}
+
+
+class StructuredFormatter(logging.Formatter):
+    """The usual text line with `extra=` fields appended as key=value, or one JSON object per line."""
+
+    def __init__(self, fmt="%(asctime)s [%(levelname)s] %(message)s", style="text"):
+        super().__init__(fmt)
+        self.style = style
+
+    def format(self, record):
+        fields = structured_fields(record)
+        if self.style == "json":
+            entry = {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_text or record.exc_info:
+                entry["exception"] = record.exc_text or self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{name}={value}" for name, value in fields.items())
+        return line
+
+
+class RateLimitedQueueHandler(QueueHandler):
+    """Hands records to the background writer, letting at most `burst` per message key through per `interval`.
+
+    The key is the `key` passed via `extra=`, or the call site (file and line), so an
+    f-string message logged in a loop counts as one message. Suppressed records are
+    summarised as "... (suppressed 4,312 similar)" once their window has passed. ERROR
+    and above are never suppressed. If the queue is full the record is dropped rather
+    than blocking the caller.
+    """
+
+    def __init__(self, log_queue, burst=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL):
+        super().__init__(log_queue)
+        self.burst = burst
+        self.interval = interval
+        # key -> [window start, records seen, records suppressed, last suppressed record]
+        self._windows = {}
+        self._last_sweep = 0.0
+        self.suppressed = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Like QueueHandler.prepare, but keeps the traceback in exc_text instead of folding it into
+        the message, so the JSON format can still put it under "exception"."""
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Tracebacks do not pickle, and the listener formats the record later in another thread
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _summary(self, window):
+        record = copy.copy(window[3])
+        record.msg = f"{record.getMessage()} (suppressed {window[2]:,} similar)"
+        record.args = None
+        return record
+
+    def _sweep(self, now):
+        # Summarise keys whose window ended without another record to carry the count
+        self._last_sweep = now
+        for key, window in list(self._windows.items()):
+            if now - window[0] >= self.interval:
+                del self._windows[key]
+                if window[2]:
+                    super().emit(self._summary(window))
+
+    def emit(self, record):
+        # Called with the handler lock held
+        now = record.created
+        if self.burst > 0 and record.levelno < logging.ERROR:
+            key = getattr(record, "key", None) or (record.pathname, record.lineno)
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None and window[2]:
+                    super().emit(self._summary(window))
+                window = self._windows[key] = [now, 0, 0, None]
+            window[1] += 1
+            if window[1] > self.burst:
+                window[2] += 1
+                window[3] = record
+                self.suppressed += 1
+                return
+            if now - self._last_sweep >= self.interval:
+                self._sweep(now)
+        super().emit(record)
+
+    def flush(self):
+        with self.lock:
+            self._sweep(float("inf"))
+
+
+_listener = None
+_queue_handler = None
+
+
+def _stop_listener():
+    global _listener
+    if _queue_handler is not None:
+        _queue_handler.flush()
+    if _listener is not None:
+        # Writes out everything still queued
+        _listener.stop()
+        _listener = None
+
+
+def _collect_metrics():
+    handler = _queue_handler
+    yield "log_records_suppressed_total", "counter", "Log records held back by the per-message rate limit", [
+        ({}, handler.suppressed if handler else 0)]
+    yield "log_records_dropped_total", "counter", "Log records dropped because the log queue was full", [
+        ({}, handler.dropped if handler else 0)]
+
+
+metrics.register_collector(_collect_metrics)
+
+
 def setup_logging():
     try:
         if sys.stdout.encoding is None or sys.stdout.encoding.lower() != 'utf-8':
@@ -102,18 +247,24 @@ def setup_logging():
         print(f"[Logging Setup] Could not create log folder: {e}")
         log_file = None
 
+    global _listener, _queue_handler
+    if _listener is not None:
+        _stop_listener()
+
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
     logger.handlers.clear()
 
-    file_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    file_formatter = StructuredFormatter(style=LOG_FORMAT)
+    # File and console handlers run on the listener thread, never on the caller's
+    handlers = []
 
     if log_file:
         try:
             open(log_file, 'w', encoding='utf-8').close()
             file_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8')
             file_handler.setFormatter(file_formatter)
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
         except Exception as e:
             print(f"[Logging Setup] Could not set up file handler: {e}")
 
@@ -121,10 +272,19 @@ def setup_logging():
     try:
         stream_handler = logging.StreamHandler()
         stream_handler.setFormatter(file_formatter)
-        logger.addHandler(stream_handler)
+        handlers.append(stream_handler)
     except Exception as e:
         print(f"[Logging Setup] Could not set up console logging: {e}")
 
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = RateLimitedQueueHandler(log_queue)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_queue_handler)
+
     logger.info("Logging setup complete.")
     if log_file:
         logger.info(f"Logs are being written to: {log_file}")
+
+
+atexit.register(_stop_listener)
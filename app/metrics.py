@@ -0,0 +1,151 @@
+"""Minimal Prometheus text-format metrics.
+
+Counters and histograms are updated on the hot path; values that already exist as
+plain attributes elsewhere (stream counts, reopens, ...) are read by collectors only
+when /metrics is scraped.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond reads to multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Distribution of observed values over fixed cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts, then the +Inf bucket, then the running sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the body of the `with` block took."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        samples = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", key + (("le", _format_value(bound)),), cumulative))
+            samples.append((self.name + "_count", key, cumulative))
+            samples.append((self.name + "_sum", key, counts[-1]))
+        return samples
+
+
+def register_collector(collect):
+    """Register `collect()`, called on every scrape, returning (name, kind, help, [(labels, value), ...]) tuples."""
+    _collectors.append(collect)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, help, samples):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+    for metric in list(_metrics):
+        family(metric.name, metric.kind, metric.help, metric.samples())
+    for collect in list(_collectors):
+        for name, kind, help, samples in collect():
+            family(name, kind, help, [(name, tuple(sorted(labels.items())), value) for labels, value in samples])
+    return "\n".join(lines) + "\n"
+
+
+# Pipeline metrics updated where the work happens
+frame_read_seconds = Histogram(
+    "camera_frame_read_seconds", "Time spent in a single frame read from the capture device", ["camera"])
+encode_seconds = Histogram(
+    "camera_encode_seconds", "Time spent encoding one JPEG (thread pool and inline encodes)", ["encoder"])
+encode_job_seconds = Histogram(
+    "camera_encode_job_seconds", "Time from submitting an encode to the pool until its result is ready, queueing included")
+lock_wait_seconds = Histogram(
+    "camera_lock_wait_seconds", "Time spent waiting to acquire a camera's lock", ["camera"])
+bytes_sent = Counter(
+    "http_response_bytes_total", "Response body bytes sent, per route", ["route"])
+
+
+def count_bytes(iterable, route):
+    """Wrap a streamed response body, counting bytes per route as chunks go out."""
+    try:
+        for chunk in iterable:
+            bytes_sent.inc(len(chunk), route=route)
+            yield chunk
+    finally:
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            close()
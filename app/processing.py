@@ -0,0 +1,278 @@
+"""Per-frame processing chain.
+
+Stages (overlays, rotation, cropping, privacy masks) run once per captured frame in the
+grabber thread, before the frame is buffered, encoded or sent, so every consumer sees
+the same processed frame and the work is never repeated per viewer.
+"""
+import json
+import logging
+import threading
+import time
+
+from app import metrics
+from app.config import PROCESSING_PIPELINE
+from app.utils import lazy_import
+
+stage_seconds = metrics.Histogram(
+    "camera_processing_stage_seconds", "Time spent in one processing stage for one frame", ["camera", "stage"])
+
+
+class Stage:
+    """One frame transform.
+
+    Subclasses validate their options in __init__ (raising ValueError or TypeError) and
+    implement apply(frame, timestamp), returning the new frame.
+    """
+
+    name = "stage"
+
+    def __init__(self, **options):
+        self.options = options
+
+    def apply(self, frame, timestamp):
+        raise NotImplementedError
+
+
+class TimestampOverlay(Stage):
+    """Draws the capture time in the top or bottom left corner of the frame."""
+
+    name = "timestamp"
+
+    def __init__(self, format="%Y-%m-%d %H:%M:%S", scale=0.6, position="bottom"):
+        super().__init__(format=format, scale=scale, position=position)
+        if position not in ("top", "bottom"):
+            raise ValueError("'position' must be 'top' or 'bottom'")
+        self.format = str(format)
+        self.scale = float(scale)
+        self.position = position
+
+    def apply(self, frame, timestamp):
+        cv2 = lazy_import("cv2")
+        text = time.strftime(self.format, time.localtime(timestamp))
+        origin = (10, frame.shape[0] - 10) if self.position == "bottom" else (10, 25)
+        # Dark outline under the text keeps it readable on bright scenes
+        cv2.putText(frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, self.scale, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, self.scale, (255, 255, 255), 1, cv2.LINE_AA)
+        return frame
+
+
+class Rotate(Stage):
+    """Rotates by 90, 180 or 270 degrees clockwise, for cameras mounted sideways or upside down."""
+
+    name = "rotate"
+
+    def __init__(self, angle=0):
+        super().__init__(angle=angle)
+        self.angle = int(angle) % 360
+        if self.angle not in (0, 90, 180, 270):
+            raise ValueError("'angle' must be a multiple of 90")
+
+    def apply(self, frame, timestamp):
+        cv2 = lazy_import("cv2")
+        codes = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+        return cv2.rotate(frame, codes[self.angle]) if self.angle else frame
+
+
+class Crop(Stage):
+    """Keeps only the region of interest x, y, width, height (clamped to the frame)."""
+
+    name = "crop"
+
+    def __init__(self, x=0, y=0, width=None, height=None):
+        super().__init__(x=x, y=y, width=width, height=height)
+        self.x, self.y = max(0, int(x)), max(0, int(y))
+        self.width = int(width) if width is not None else None
+        self.height = int(height) if height is not None else None
+        if (self.width is not None and self.width <= 0) or (self.height is not None and self.height <= 0):
+            raise ValueError("'width' and 'height' must be positive")
+
+    def apply(self, frame, timestamp):
+        bottom = self.y + self.height if self.height is not None else None
+        right = self.x + self.width if self.width is not None else None
+        # A view, not a copy; the ring buffer copies it once anyway
+        cropped = frame[self.y:bottom, self.x:right]
+        if not cropped.size:
+            raise ValueError(f"crop region ({self.x}, {self.y}) is outside the {frame.shape[1]}x{frame.shape[0]} frame")
+        return cropped
+
+
+class PrivacyMask(Stage):
+    """Blanks (or pixelates, with mode="pixelate") rectangles given as [x, y, width, height]."""
+
+    name = "privacy_mask"
+
+    def __init__(self, regions=(), mode="fill", block=16, color=0):
+        super().__init__(regions=regions, mode=mode, block=block, color=color)
+        if mode not in ("fill", "pixelate"):
+            raise ValueError("'mode' must be 'fill' or 'pixelate'")
+        self.regions = []
+        for region in regions:
+            x, y, width, height = (int(value) for value in region)
+            self.regions.append((max(0, x), max(0, y), width, height))
+        self.pixelate = mode == "pixelate"
+        self.block = max(2, int(block))
+        self.color = color
+
+    def apply(self, frame, timestamp):
+        cv2 = lazy_import("cv2")
+        for x, y, width, height in self.regions:
+            region = frame[y:y + height, x:x + width]
+            if not region.size:
+                continue
+            if self.pixelate:
+                size = (max(1, region.shape[1] // self.block), max(1, region.shape[0] // self.block))
+                small = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+                region[...] = cv2.resize(small, (region.shape[1], region.shape[0]), interpolation=cv2.INTER_NEAREST)
+            else:
+                region[...] = self.color
+        return frame
+
+
+# Stage types available to pipelines, by name; register_stage() adds more
+STAGES = {stage.name: stage for stage in (TimestampOverlay, Rotate, Crop, PrivacyMask)}
+
+
+def register_stage(stage_class):
+    """Make a Stage subclass available to pipelines under its `name`."""
+    STAGES[stage_class.name] = stage_class
+    return stage_class
+
+
+class StageSlot:
+    """A stage in a pipeline, under its own id, with its on/off switch and timing counters."""
+
+    def __init__(self, slot_id, stage, enabled=True):
+        self.id = slot_id
+        self.stage = stage
+        self.enabled = enabled
+        self.frames = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.last_ms = 0.0
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "stage": self.stage.name,
+            "enabled": self.enabled,
+            "options": self.stage.options,
+            "frames": self.frames,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / self.frames * 1000, 3) if self.frames else None,
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+class FramePipeline:
+    """Ordered stages applied to every frame of one camera; stages can be added, removed, reordered,
+    toggled or reconfigured live.
+
+    Each slot has an id (the stage name, then "<name>-2", "<name>-3", ... or one given in the
+    config), so a pipeline can hold several instances of the same stage, e.g. two privacy masks.
+    """
+
+    def __init__(self, camera_id, config=()):
+        self.camera_id = camera_id
+        self._lock = threading.Lock()
+        self._slots = []
+        for entry in config:
+            entry = dict(entry)
+            try:
+                self.add(entry.pop("stage", None), enabled=entry.pop("enabled", True),
+                         slot_id=entry.pop("id", None), options=entry)
+            except (ValueError, TypeError) as e:
+                logging.error(f"Camera {camera_id}: invalid processing stage {entry}: {e}")
+
+    def _find(self, slot_id):
+        return next((slot for slot in self._slots if slot.id == slot_id), None)
+
+    def _append(self, name, enabled, options, slot_id=None):
+        # Caller holds self._lock
+        if name not in STAGES:
+            raise ValueError(f"Unknown processing stage '{name}' (available: {', '.join(sorted(STAGES))})")
+        if slot_id is None:
+            slot_id, n = name, 1
+            while self._find(slot_id) is not None:
+                n += 1
+                slot_id = f"{name}-{n}"
+        elif self._find(str(slot_id)) is not None:
+            raise ValueError(f"Processing stage id '{slot_id}' is already in use")
+        slot = StageSlot(str(slot_id), STAGES[name](**(options or {})), enabled)
+        # Copy on write, so the grabber thread can iterate without the lock
+        self._slots = self._slots + [slot]
+        return slot
+
+    def add(self, name, enabled=True, options=None, slot_id=None):
+        """Append a new instance of stage `name`, even if the pipeline already has one."""
+        with self._lock:
+            return self._append(name, enabled, options, slot_id)
+
+    def configure(self, slot_id, enabled=None, options=None):
+        """Enable/disable a stage and/or replace its options.
+
+        `slot_id` names a slot; a stage name the pipeline does not hold yet appends that stage.
+        """
+        with self._lock:
+            slot = self._find(slot_id)
+            if slot is None:
+                return self._append(slot_id, True if enabled is None else enabled, options)
+            if options is not None:
+                slot.stage = STAGES[slot.stage.name](**options)
+            if enabled is not None:
+                slot.enabled = enabled
+            return slot
+
+    def remove(self, slot_id):
+        """Drop a slot; returns False if there is none with that id."""
+        with self._lock:
+            slot = self._find(slot_id)
+            if slot is None:
+                return False
+            self._slots = [other for other in self._slots if other is not slot]
+            return True
+
+    def reorder(self, order):
+        """Put the slots in the order of the given ids, which must name every slot exactly once."""
+        with self._lock:
+            if sorted(map(str, order)) != sorted(slot.id for slot in self._slots):
+                raise ValueError(f"'order' must list every stage id exactly once: {[slot.id for slot in self._slots]}")
+            self._slots = [self._find(str(slot_id)) for slot_id in order]
+
+    def process(self, frame, timestamp):
+        """Run the enabled stages in order; a failing stage is skipped for that frame."""
+        for slot in self._slots:
+            if not slot.enabled:
+                continue
+            started = time.perf_counter()
+            try:
+                frame = slot.stage.apply(frame, timestamp)
+            except Exception as e:
+                slot.errors += 1
+                # Errors are not rate limited, and a broken stage fails on every frame
+                if slot.errors == 1 or slot.errors % 100 == 0:
+                    logging.error(f"Processing stage {slot.id} failed on camera {self.camera_id} "
+                                  f"({slot.errors} times): {e}", extra={"camera": self.camera_id, "stage": slot.id})
+                continue
+            elapsed = time.perf_counter() - started
+            slot.frames += 1
+            slot.total_seconds += elapsed
+            slot.last_ms = elapsed * 1000
+            stage_seconds.observe(elapsed, camera=self.camera_id, stage=slot.id)
+        return frame
+
+    def describe(self):
+        return [slot.describe() for slot in self._slots]
+
+
+def parse_pipeline_config(value=PROCESSING_PIPELINE):
+    """Stage list from CAMERA_PIPELINE: a JSON list like [{"stage": "rotate", "angle": 90}], or a file holding one."""
+    if not value:
+        return []
+    try:
+        if value.lstrip().startswith("["):
+            return json.loads(value)
+        with open(value, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Ignoring invalid processing pipeline config: {e}")
+        return []
@@ -0,0 +1,164 @@
+"""Uncompressed frames for machine consumers.
+
+The newest frame is sent as raw pixels with its shape and dtype, so consumers skip
+the JPEG encode/decode round trip. Served over HTTP and, for local consumers, over a
+Unix socket.
+
+BGR frames are sent straight from the frame the grabber published
+(Camera.published_frame), which nothing writes to once published, through memoryview
+slices and without any copy; a slow client only keeps that frame alive, it never holds
+up capture. Gray and YUV frames are converted into a new array, which is sent the same
+way. Only a frame that is not C-contiguous (e.g. from the crop stage) is copied once.
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import stat
+import threading
+
+from app import camera
+from app.utils import lazy_import
+
+# Raw layouts: "bgr" (H, W, 3), "gray" (H, W), "yuv" planar I420 (H * 3 / 2, W)
+RAW_FORMATS = ("bgr", "gray", "yuv")
+
+# Largest slice of the frame handed to the WSGI server in one write
+CHUNK_SIZE = 256 * 1024
+
+# Owner and group only: any process that can connect can read camera frames
+SOCKET_MODE = 0o660
+
+
+def convert(frame, fmt):
+    """The frame in the requested raw layout, C-contiguous; BGR frames are returned as is."""
+    cv2 = lazy_import("cv2")
+    if fmt == "gray":
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if fmt == "yuv":
+        # I420 needs even dimensions
+        height, width = frame.shape[0] & ~1, frame.shape[1] & ~1
+        return cv2.cvtColor(frame[:height, :width], cv2.COLOR_BGR2YUV_I420)
+    return lazy_import("numpy").ascontiguousarray(frame)
+
+
+def latest_raw(cam, fmt="bgr"):
+    """(metadata, array) for the newest frame of `cam`, or None if the camera is unavailable."""
+    if fmt not in RAW_FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(RAW_FORMATS)}")
+    if not cam.ensure():
+        logging.error(f"Camera {cam.id} unavailable for raw frame")
+        return None
+    item = cam.published_frame()
+    if item is None:
+        logging.error(f"Timed out waiting for a raw frame on camera {cam.id}")
+        return None
+
+    seq, timestamp, frame = item
+    array = convert(frame, fmt)
+    metadata = {
+        "camera": cam.id,
+        "seq": seq,
+        "timestamp": timestamp,
+        "format": fmt,
+        "shape": list(array.shape),
+        "dtype": str(array.dtype),
+        "size": array.nbytes,
+    }
+    return metadata, array
+
+
+def frame_headers(metadata):
+    return {
+        "X-Camera-Id": metadata["camera"],
+        "X-Frame-Sequence": str(metadata["seq"]),
+        "X-Frame-Timestamp": f"{metadata['timestamp']:.6f}",
+        "X-Frame-Format": metadata["format"],
+        "X-Frame-Shape": ",".join(str(n) for n in metadata["shape"]),
+        "X-Frame-Dtype": metadata["dtype"],
+    }
+
+
+def frame_chunks(array, chunk_size=CHUNK_SIZE):
+    """Slices of the array's buffer as byte memoryviews; nothing is copied here."""
+    view = memoryview(array).cast("B")
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+class RawFrameServer:
+    """Serves raw frames on a Unix socket.
+
+    A client sends one request line per frame, `<format> [<cam_id>]`, and gets back a
+    JSON metadata line (as in frame_headers, plus "size") followed by exactly "size"
+    bytes of pixels, sent straight from the frame buffer. Errors are a JSON line with
+    an "error" key and no pixels. Connections stay open for further requests.
+    """
+
+    def __init__(self, path, mode=SOCKET_MODE):
+        self.path = path
+        self.mode = mode
+        self._socket = None
+
+    def start(self):
+        if not hasattr(socket, "AF_UNIX"):
+            logging.error("Unix sockets are not supported on this platform; raw frame socket disabled")
+            return False
+        try:
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                logging.error(f"{self.path} exists and is not a socket; raw frame socket disabled")
+                return False
+            # Left behind by a previous run
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        # Restrict access before listening, so nobody can connect under the default umask
+        os.chmod(self.path, self.mode)
+        self._socket.listen()
+        threading.Thread(target=self._accept, name="raw-frames", daemon=True).start()
+        atexit.register(self.stop)
+        logging.info(f"Serving raw frames on unix socket {self.path}")
+        return True
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _accept(self):
+        while self._socket is not None:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), name="raw-frames-client", daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rb") as requests:
+            for line in requests:
+                parts = line.decode(errors="replace").split()
+                fmt = parts[0] if parts else "bgr"
+                try:
+                    cam = camera.get_camera(parts[1] if len(parts) > 1 else None)
+                    result = latest_raw(cam, fmt)
+                    if result is None:
+                        raise RuntimeError("camera unavailable")
+                except KeyError:
+                    result, error = None, f"unknown camera '{parts[1]}'"
+                except (ValueError, RuntimeError) as e:
+                    result, error = None, str(e)
+
+                try:
+                    if result is None:
+                        conn.sendall(json.dumps({"error": error}).encode() + b"\n")
+                        continue
+                    metadata, array = result
+                    conn.sendall(json.dumps(metadata).encode() + b"\n")
+                    conn.sendall(memoryview(array).cast("B"))
+                except OSError:
+                    return
@@ -0,0 +1,239 @@
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+
+from app import metrics
+from app.config import (
+    RECORDING_FOLDER,
+    RECORDING_SEGMENT_SECONDS,
+    RECORDING_CODEC,
+    RECORDING_QUEUE_SIZE,
+    RECORDING_DROP_POLICY,
+    RECORDING_MAX_MB,
+    RECORDING_MAX_AGE_HOURS,
+)
+from app.utils import lazy_import
+
+# Container used for each FourCC; anything else is written as AVI
+CODEC_EXTENSIONS = {"MJPG": ".avi", "XVID": ".avi", "mp4v": ".mp4", "avc1": ".mp4"}
+SEGMENT_PATTERN = re.compile(r"^(?P<camera>.+)_(?P<start>\d{8}T\d{9})\.(?:avi|mp4)$")
+
+# Frame rate written into segment headers when the grabber has not measured one yet
+DEFAULT_FPS = 15.0
+
+
+def segment_name(cam_id, timestamp, codec):
+    """File name for a segment starting at `timestamp`: camera id plus sortable local start time."""
+    millis = int(timestamp * 1000) % 1000
+    start = time.strftime("%Y%m%dT%H%M%S", time.localtime(timestamp)) + f"{millis:03d}"
+    return f"{cam_id}_{start}{CODEC_EXTENSIONS.get(codec, '.avi')}"
+
+
+class Recorder:
+    """Writes one camera's frames to time-segmented video files from a dedicated writer thread.
+
+    Frames arrive through an ordinary grabber subscription whose mailbox is the bounded
+    queue. When the disk stalls the mailbox fills up and frames are dropped according to
+    `drop`, so the grabber and live viewers never wait on the writer.
+    """
+
+    def __init__(self, cam, folder=RECORDING_FOLDER, segment_seconds=RECORDING_SEGMENT_SECONDS,
+                 codec=RECORDING_CODEC, queue_size=RECORDING_QUEUE_SIZE, drop=RECORDING_DROP_POLICY):
+        self.cam = cam
+        self.folder = folder
+        self.segment_seconds = segment_seconds
+        self.codec = codec
+        self.started_at = time.time()
+        self.frames_written = 0
+        self.segments = 0
+        self.path = None
+        self._writer = None
+        self._size = None
+        self._segment_start = 0.0
+        self._stopping = False
+
+        os.makedirs(folder, exist_ok=True)
+        self.subscriber = cam.grabber.subscribe(capacity=queue_size, drop=drop, stream=False)
+        self._thread = threading.Thread(target=self._run, name=f"recorder-{cam.id}", daemon=True)
+
+    @property
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Finish the current segment and stop the writer thread."""
+        self._stopping = True
+        self.subscriber.wake()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        logging.info(f"Recording camera {self.cam.id} to {self.folder} in {self.segment_seconds}s segments")
+        try:
+            if not self.cam.ensure():
+                logging.error(f"Camera {self.cam.id} unavailable for recording")
+                return
+            while not self._stopping:
+                item = self.subscriber.next_frame(timeout=1.0)
+                if item is None:
+                    if self.cam.shutdown_flag:
+                        logging.info(f"Shutdown detected, stopping recording on camera {self.cam.id}")
+                        break
+                    if not self.cam.grabber.is_running:
+                        self.cam.grabber.request()
+                    continue
+                self._write(*item)
+        except Exception as e:
+            logging.error(f"Recording on camera {self.cam.id} failed: {e}", exc_info=True)
+        finally:
+            self.subscriber.close()
+            self._close_segment()
+            with _recorders_lock:
+                if recorders.get(self.cam.id) is self:
+                    del recorders[self.cam.id]
+                finished_drops[self.cam.id] = finished_drops.get(self.cam.id, 0) + self.subscriber.frames_dropped
+            logging.info(f"Recording on camera {self.cam.id} stopped after {self.frames_written} frames "
+                         f"in {self.segments} segments ({self.subscriber.frames_dropped} dropped)")
+
+    def _write(self, seq, timestamp, frame):
+        size = (frame.shape[1], frame.shape[0])
+        if self._writer is None or size != self._size or timestamp - self._segment_start >= self.segment_seconds:
+            self._close_segment()
+            self._open_segment(timestamp, size)
+        self._writer.write(frame)
+        self.frames_written += 1
+
+    def _open_segment(self, timestamp, size):
+        cv2 = lazy_import("cv2")
+        fps = round(self.cam.grabber.fps, 2) or self.cam.options.get("fps") or DEFAULT_FPS
+        path = os.path.join(self.folder, segment_name(self.cam.id, timestamp, self.codec))
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), fps, size)
+        if not writer.isOpened():
+            raise RuntimeError(f"could not open a {self.codec} writer for {path}")
+        self._writer, self.path, self._size, self._segment_start = writer, path, size, timestamp
+        logging.info(f"Recording segment started: {path} ({size[0]}x{size[1]} @ {fps} fps)")
+
+    def _close_segment(self):
+        if self._writer is None:
+            return
+        self._writer.release()
+        self._writer = None
+        self.segments += 1
+        self.path = None
+        enforce_retention(self.folder)
+
+    def stats(self):
+        return {
+            "camera": self.cam.id,
+            "started_at": self.started_at,
+            "segment_seconds": self.segment_seconds,
+            "codec": self.codec,
+            "current_segment": os.path.basename(self.path) if self.path else None,
+            "segments": self.segments,
+            "frames_written": self.frames_written,
+            "frames_dropped": self.subscriber.frames_dropped,
+            "queued": self.subscriber.queued,
+        }
+
+
+# Active recorders, keyed by camera id
+recorders = {}
+# Frames dropped by finished recorders, keyed by camera id
+finished_drops = {}
+_recorders_lock = threading.Lock()
+
+
+def start_recording(cam, **options):
+    """Start recording `cam` unless it already is; returns (recorder, started)."""
+    with _recorders_lock:
+        recorder = recorders.get(cam.id)
+        if recorder is not None and recorder.is_alive:
+            return recorder, False
+        recorder = recorders[cam.id] = Recorder(cam, **options)
+    return recorder.start(), True
+
+
+def stop_recording(cam_id):
+    """Stop recording a camera; returns the recorder's final stats, or None if it was not recording."""
+    with _recorders_lock:
+        recorder = recorders.get(cam_id)
+    if recorder is None:
+        return None
+    recorder.stop()
+    return recorder.stats()
+
+
+def stop_all():
+    for cam_id in list(recorders):
+        stop_recording(cam_id)
+
+
+# Finish open segments so their container headers are written
+atexit.register(stop_all)
+
+
+def list_recordings(folder=RECORDING_FOLDER, camera_id=None):
+    """Segments on disk, oldest first; the ones still being written are flagged as recording."""
+    if not os.path.isdir(folder):
+        return []
+    open_paths = {recorder.path for recorder in list(recorders.values()) if recorder.path}
+    segments = []
+    for name in sorted(os.listdir(folder)):
+        match = SEGMENT_PATTERN.match(name)
+        if not match or (camera_id is not None and match.group("camera") != camera_id):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        segments.append({
+            "name": name,
+            "camera": match.group("camera"),
+            "started": time.mktime(time.strptime(match.group("start")[:15], "%Y%m%dT%H%M%S")),
+            "modified": stat.st_mtime,
+            "size": stat.st_size,
+            "recording": path in open_paths,
+        })
+    return sorted(segments, key=lambda segment: segment["started"])
+
+
+def enforce_retention(folder=RECORDING_FOLDER, max_bytes=RECORDING_MAX_MB * 1024 * 1024,
+                      max_age=RECORDING_MAX_AGE_HOURS * 3600):
+    """Delete the oldest finished segments until the total size and age limits hold."""
+    finished = [segment for segment in list_recordings(folder) if not segment["recording"]]
+    total = sum(segment["size"] for segment in finished)
+    now = time.time()
+    for segment in finished:
+        too_big = max_bytes and total > max_bytes
+        too_old = max_age and now - segment["modified"] > max_age
+        if not (too_big or too_old):
+            continue
+        try:
+            os.remove(os.path.join(folder, segment["name"]))
+            total -= segment["size"]
+            logging.info(f"Recording retention: deleted {segment['name']}")
+        except OSError as e:
+            logging.warning(f"Recording retention: could not delete {segment['name']}: {e}")
+
+
+def _collect_metrics():
+    with _recorders_lock:
+        active = list(recorders.values())
+        dropped = dict(finished_drops)
+    yield "camera_recording_frames_written_total", "counter", "Frames written by the active recorder", [
+        ({"camera": recorder.cam.id}, recorder.frames_written) for recorder in active]
+    for recorder in active:
+        dropped[recorder.cam.id] = dropped.get(recorder.cam.id, 0) + recorder.subscriber.frames_dropped
+    yield "camera_recording_dropped_frames_total", "counter", "Frames the recorder dropped because the writer fell behind", [
+        ({"camera": cam_id}, count) for cam_id, count in dropped.items()]
+
+
+metrics.register_collector(_collect_metrics)
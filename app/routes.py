@@ -38,94 +38,410 @@
 #     def shutdown():
 #         return shutdown_server()
 
-from flask import Response, jsonify, send_file, request
+from flask import Response, jsonify, send_file, send_from_directory, request, abort
 import os
-import tempfile
-import time
 import logging
-import concurrent.futures
-import atexit
+import io
+import json
+import zipfile
+from datetime import datetime, timezone
 from werkzeug.exceptions import HTTPException
 
+from app import metrics, startup
+from app.captures import capture_store, CAPTURE_ID_PATTERN
+from app.rawframes import latest_raw, frame_headers, frame_chunks
+from app.cleanup import temp_cleaner
+from app.config import (
+    BURST_MAX_FRAMES,
+    BURST_MAX_INTERVAL_MS,
+    CAPTURE_BEST_OF,
+    FRAME_RING_SIZE,
+    RECORDING_FOLDER,
+)
+from app.recording import recorders, start_recording, stop_recording, list_recordings, SEGMENT_PATTERN
+from app.encoding import parse_variant_args
 from app.camera import (
-    generate_frames,
-    capture_image,
+    cameras,
+    get_camera,
+    stream_stats,
     shutdown_camera,
     shutdown_server,
-    IMAGE_PATH,
 )
 
 # 🔧 Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# ✅ ThreadPoolExecutor for background cleanup
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
-atexit.register(executor.shutdown)
-atexit.register(lambda: executor.shutdown(wait=False, cancel_futures=True))
-
-# ✅ Actual cleanup function
-def cleanup_opencv_temp_files():
-    temp_dir = os.environ.get('TEMP') or tempfile.gettempdir()
-    now = time.time()
-    for fname in os.listdir(temp_dir):
-        if fname.lower().startswith('opencv') or fname.lower().endswith(('.dll', '.bin')):
-            path = os.path.join(temp_dir, fname)
-            if os.path.isfile(path):
-                try:
-                    if now - os.path.getmtime(path) > 300:  # older than 5 min
-                        os.remove(path)
-                        logger.info(f"Deleted old OpenCV temp file: {path}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove temp file {path}: {e}")
-
-# ✅ Non-blocking background scheduler
+# ✅ Non-blocking background cleanup: requests only nudge the shared cleanup service
 def schedule_cleanup():
-    executor.submit(cleanup_opencv_temp_files)
+    temp_cleaner.trigger()
+
+def _lookup_camera(cam_id):
+    """Resolve a camera id from the URL (None = default camera), aborting with 404 if unknown"""
+    try:
+        return get_camera(cam_id)
+    except KeyError:
+        abort(404, description=f"Unknown camera '{cam_id}'")
+
+def _parse_since(value):
+    """Accept a unix timestamp or an ISO 8601 date/time for ?since="""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        abort(400, description="'since' must be a unix timestamp or ISO 8601 date/time")
+
+def _not_modified(record):
+    """True if the client's cached copy of this capture (If-None-Match / If-Modified-Since) is current"""
+    etag = record.get("etag")
+    if request.if_none_match:
+        return bool(etag) and request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return int(record["timestamp"]) <= request.if_modified_since.timestamp()
+    return False
+
+def _capture_response(record, payload=None, status=200):
+    """Capture image response with ETag / Last-Modified validators; no body for 304"""
+    response = Response(payload, status=status, mimetype='image/jpeg')
+    if record.get("etag"):
+        response.set_etag(record["etag"])
+    response.last_modified = datetime.fromtimestamp(int(record["timestamp"]), timezone.utc)
+    response.cache_control.no_cache = True
+    response.headers['Content-Disposition'] = f"attachment; filename={record['id']}.jpg"
+    return response
+
+def _capture_json(record):
+    return dict(record, url=f"{request.host_url}image/{record['id']}")
+
+def _require_capture_process(cam):
+    """Recorders are per process, so in worker processes (shared memory frames) they are not started or stopped"""
+    if cam.options.get("source") == "shared":
+        abort(409, description="Recording is controlled by the capture process; send this request to it")
+
+def _parse_best_of():
+    """Validate ?best_of= (how many buffered frames a capture picks from)"""
+    try:
+        best_of = int(request.args.get("best_of", min(CAPTURE_BEST_OF, FRAME_RING_SIZE)))
+    except ValueError:
+        abort(400, description="'best_of' must be an integer")
+    if not 1 <= best_of <= FRAME_RING_SIZE:
+        abort(400, description=f"'best_of' must be between 1 and {FRAME_RING_SIZE}")
+    return best_of
+
+def _parse_burst_args():
+    """Validate ?count=&interval_ms=&format= for burst captures"""
+    try:
+        count = int(request.args.get("count", 5))
+        interval_ms = int(request.args.get("interval_ms", 0))
+    except ValueError:
+        abort(400, description="'count' and 'interval_ms' must be integers")
+    if not 1 <= count <= BURST_MAX_FRAMES:
+        abort(400, description=f"'count' must be between 1 and {BURST_MAX_FRAMES}")
+    if not 0 <= interval_ms <= BURST_MAX_INTERVAL_MS:
+        abort(400, description=f"'interval_ms' must be between 0 and {BURST_MAX_INTERVAL_MS}")
+    fmt = request.args.get("format", "multipart")
+    if fmt not in ("multipart", "zip"):
+        abort(400, description="'format' must be 'multipart' or 'zip'")
+    return count, interval_ms, fmt
+
+def _burst_response(cam, frames, fmt):
+    """Burst frames as one multipart/mixed or zip response, with each frame's sequence number and timestamp"""
+    manifest = []
+    for index, (seq, timestamp, future) in enumerate(frames):
+        manifest.append({
+            "index": index,
+            "seq": seq,
+            "timestamp": timestamp,
+            "time": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+            "filename": f"frame_{index:02d}.jpg",
+            "payload": future.result(),
+        })
+
+    if fmt == "zip":
+        buffer = io.BytesIO()
+        # JPEGs do not compress further, so store them as they are
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for entry in manifest:
+                archive.writestr(entry["filename"], entry["payload"])
+            archive.writestr("manifest.json", json.dumps(
+                {"camera": cam.id, "frames": [{k: v for k, v in entry.items() if k != "payload"}
+                                              for entry in manifest]}, indent=2))
+        response = Response(buffer.getvalue(), mimetype="application/zip")
+        response.headers['Content-Disposition'] = f"attachment; filename=burst_{cam.id}.zip"
+    else:
+        boundary = "burst"
+        parts = []
+        for entry in manifest:
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: image/jpeg\r\n"
+                f"Content-Length: {len(entry['payload'])}\r\n"
+                f"Content-Disposition: attachment; filename={entry['filename']}\r\n"
+                f"X-Frame-Index: {entry['index']}\r\n"
+                f"X-Frame-Sequence: {entry['seq']}\r\n"
+                f"X-Frame-Timestamp: {entry['timestamp']:.6f}\r\n\r\n".encode() + entry["payload"] + b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode())
+        response = Response(b"".join(parts), mimetype=f"multipart/mixed; boundary={boundary}")
+    response.headers['X-Camera-Id'] = cam.id
+    response.headers['X-Burst-Count'] = str(len(manifest))
+    return response
 
 # ✅ Route registration
 def init_routes(app):
 
-    @app.route("/video_feed")
-    def video_feed():
+    @app.route("/video_feed", defaults={"cam_id": None})
+    @app.route("/video_feed/<cam_id>")
+    def video_feed(cam_id):
+        cam = _lookup_camera(cam_id)
+        try:
+            params = parse_variant_args(request.args)
+        except ValueError as e:
+            abort(400, description=str(e))
         try:
             schedule_cleanup()
-            return Response(generate_frames(), content_type="multipart/x-mixed-replace;boundary=frame")
+            return Response(cam.generate_frames(params), content_type="multipart/x-mixed-replace;boundary=frame")
         except Exception as e:
             logger.error(f"Error in /video_feed: {e}", exc_info=True)
             return "Streaming error", 500
 
-    @app.route('/capture', methods=['POST'])
-    def capture():
+    @app.route('/capture', methods=['POST'], defaults={"cam_id": None})
+    @app.route('/capture/<cam_id>', methods=['POST'])
+    def capture(cam_id):
+        cam = _lookup_camera(cam_id)
+        best_of = _parse_best_of()
         try:
             schedule_cleanup()
-            success = capture_image()
-            if success:
-                return jsonify({"message": "Image captured", "url": f"{request.host_url}image/captured.jpg"})
+            record = cam.capture_image(best_of)
+            if record:
+                return jsonify(dict(_capture_json(record), message="Image captured"))
             return "Capture failed", 500
         except Exception as e:
             logger.error(f"Error in /capture: {e}", exc_info=True)
             return "Capture error", 500
 
-    @app.route("/image", methods=["GET"])
-    def get_image():
+    @app.route('/capture/burst', methods=['POST'], defaults={"cam_id": None})
+    @app.route('/capture/<cam_id>/burst', methods=['POST'])
+    def capture_burst(cam_id):
+        cam = _lookup_camera(cam_id)
+        count, interval_ms, fmt = _parse_burst_args()
+        try:
+            frames = cam.capture_burst(count, interval_ms / 1000.0)
+            if frames:
+                return _burst_response(cam, frames, fmt)
+            return "Burst capture failed", 500
+        except Exception as e:
+            logger.error(f"Error in /capture/burst: {e}", exc_info=True)
+            return "Burst capture error", 500
+
+    @app.route("/snapshot.jpg", defaults={"cam_id": None})
+    @app.route("/snapshot/<cam_id>.jpg")
+    def snapshot(cam_id):
+        cam = _lookup_camera(cam_id)
+        try:
+            payload = cam.snapshot_jpeg()
+            if payload is None:
+                return "Camera unavailable", 503
+            return Response(payload, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+        except Exception as e:
+            logger.error(f"Error in /snapshot.jpg: {e}", exc_info=True)
+            return "Snapshot error", 500
+
+    @app.route("/frame.raw", defaults={"cam_id": None})
+    @app.route("/frame/<cam_id>.raw")
+    def raw_frame(cam_id):
+        cam = _lookup_camera(cam_id)
+        try:
+            result = latest_raw(cam, request.args.get("format", "bgr"))
+        except ValueError as e:
+            abort(400, description=str(e))
+        try:
+            if result is None:
+                return "Camera unavailable", 503
+            metadata, array = result
+            response = Response(frame_chunks(array), mimetype="application/octet-stream",
+                                headers=frame_headers(metadata))
+            response.content_length = metadata["size"]
+            response.cache_control.no_store = True
+            return response
+        except Exception as e:
+            logger.error(f"Error in /frame.raw: {e}", exc_info=True)
+            return "Raw frame error", 500
+
+    @app.route("/image", methods=["GET"], defaults={"key": None})
+    @app.route("/image/<key>", methods=["GET"])
+    def get_image(key):
+        # /image/<key> is either a camera id (its latest capture) or a capture id
+        if key is not None and key not in cameras and CAPTURE_ID_PATTERN.match(key):
+            record = capture_store.record(key)
+            if record is None:
+                abort(404, description=f"Unknown capture '{key}'")
+        else:
+            cam = _lookup_camera(key)
+            record = capture_store.latest_record(cam.id)
         try:
-            if os.path.exists(IMAGE_PATH):
-                return send_file(IMAGE_PATH, mimetype='image/jpeg', as_attachment=True, download_name='captured_image.jpg')
+            if record is not None:
+                # Answer revalidation from the in-memory index without loading the image
+                if _not_modified(record):
+                    return _capture_response(record, status=304)
+                found = capture_store.get(record["id"])
+                if found is not None:
+                    record, payload = found
+                    return _capture_response(record, payload)
+                return "Image not found", 404
+            if os.path.exists(cam.image_path):
+                return send_file(cam.image_path, mimetype='image/jpeg', as_attachment=True, download_name='captured_image.jpg')
             return "No image found", 404
         except Exception as e:
             logger.error(f"Error in /image: {e}", exc_info=True)
             return "Failed to retrieve image", 500
 
+    @app.route('/captures')
+    def list_captures():
+        since = _parse_since(request.args.get("since"))
+        camera_id = request.args.get("camera")
+        try:
+            limit = int(request.args.get("limit", 100))
+        except ValueError:
+            abort(400, description="'limit' must be an integer")
+        if limit < 0:
+            abort(400, description="'limit' must be 0 (no limit) or more")
+        records = capture_store.list(since=since, camera_id=camera_id, limit=limit)
+        return jsonify({"captures": [_capture_json(record) for record in records]})
+
+    @app.route('/recording/start', methods=['POST'], defaults={"cam_id": None})
+    @app.route('/recording/start/<cam_id>', methods=['POST'])
+    def recording_start(cam_id):
+        cam = _lookup_camera(cam_id)
+        _require_capture_process(cam)
+        options = {}
+        if "segment_seconds" in request.args:
+            try:
+                options["segment_seconds"] = int(request.args["segment_seconds"])
+            except ValueError:
+                abort(400, description="'segment_seconds' must be an integer")
+            if options["segment_seconds"] < 1:
+                abort(400, description="'segment_seconds' must be at least 1")
+        try:
+            recorder, started = start_recording(cam, **options)
+            message = "Recording started" if started else "Already recording"
+            return jsonify({"message": message, "recording": recorder.stats()})
+        except Exception as e:
+            logger.error(f"Error in /recording/start: {e}", exc_info=True)
+            return "Recording error", 500
+
+    @app.route('/recording/stop', methods=['POST'], defaults={"cam_id": None})
+    @app.route('/recording/stop/<cam_id>', methods=['POST'])
+    def recording_stop(cam_id):
+        cam = _lookup_camera(cam_id)
+        _require_capture_process(cam)
+        stats = stop_recording(cam.id)
+        if stats is None:
+            return jsonify({"message": f"Camera {cam.id} is not recording"}), 409
+        return jsonify({"message": "Recording stopped", "recording": stats})
+
+    @app.route('/recordings')
+    def recordings():
+        return jsonify({
+            "active": [recorder.stats() for recorder in list(recorders.values())],
+            "segments": list_recordings(camera_id=request.args.get("camera")),
+        })
+
+    @app.route('/recordings/<name>')
+    def recording_file(name):
+        if not SEGMENT_PATTERN.match(name):
+            abort(404, description="Recording not found")
+        return send_from_directory(RECORDING_FOLDER, name, as_attachment=True)
+
+    @app.route('/pipeline', methods=['GET', 'PUT'])
+    def pipeline():
+        cam = _lookup_camera(request.args.get("camera"))
+        if request.method == 'PUT':
+            order = (request.get_json(silent=True) or {}).get("order")
+            if not isinstance(order, list):
+                abort(400, description="'order' must be a list of stage ids")
+            try:
+                cam.pipeline.reorder(order)
+            except ValueError as e:
+                abort(400, description=str(e))
+            logger.info(f"Camera {cam.id}: processing stages reordered to {order}")
+        return jsonify({"camera": cam.id, "stages": cam.pipeline.describe()})
+
+    @app.route('/pipeline/<stage>', methods=['POST'])
+    def configure_pipeline_stage(stage):
+        cam = _lookup_camera(request.args.get("camera"))
+        body = request.get_json(silent=True) or {}
+        enabled = body.get("enabled")
+        if enabled is not None and not isinstance(enabled, bool):
+            abort(400, description="'enabled' must be true or false")
+        if "enabled" in request.args:
+            value = request.args["enabled"].lower()
+            if value not in ("1", "true", "yes", "on", "0", "false", "no", "off"):
+                abort(400, description="'enabled' must be 0/1 or true/false")
+            enabled = value in ("1", "true", "yes", "on")
+        options = body.get("options")
+        if options is not None and not isinstance(options, dict):
+            abort(400, description="'options' must be an object")
+        add = body.get("add", False)
+        if not isinstance(add, bool):
+            abort(400, description="'add' must be true or false")
+        try:
+            if add:
+                slot = cam.pipeline.add(stage, True if enabled is None else enabled, options, body.get("id"))
+            else:
+                slot = cam.pipeline.configure(stage, enabled=enabled, options=options)
+        except (ValueError, TypeError) as e:
+            abort(400, description=str(e))
+        logger.info(f"Camera {cam.id}: processing stage {slot.id} {'enabled' if slot.enabled else 'disabled'}")
+        return jsonify({"camera": cam.id, "stage": slot.describe()})
+
+    @app.route('/pipeline/<slot_id>', methods=['DELETE'])
+    def remove_pipeline_stage(slot_id):
+        cam = _lookup_camera(request.args.get("camera"))
+        if not cam.pipeline.remove(slot_id):
+            abort(404, description=f"No processing stage '{slot_id}' on camera {cam.id}")
+        logger.info(f"Camera {cam.id}: processing stage {slot_id} removed")
+        return jsonify({"camera": cam.id, "stages": cam.pipeline.describe()})
+
+    @app.route('/streams')
+    def streams():
+        return jsonify(stream_stats())
+
     @app.route('/health')
     def health():
         return {'status': 'healthy'}, 200
 
-    @app.route('/shutdown-camera', methods=['POST'])
-    def shutdown_camera_route():
+    @app.route('/ready')
+    def ready():
+        status = startup.status(get_camera())
+        return jsonify(status), 200 if status["ready"] else 503
+
+    @app.route('/metrics')
+    def metrics_route():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.after_request
+    def count_response_bytes(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        if response.is_streamed:
+            # Streams (MJPEG, files) are counted chunk by chunk as they are sent
+            response.response = metrics.count_bytes(response.response, route)
+        else:
+            metrics.bytes_sent.inc(response.content_length or 0, route=route)
+        return response
+
+    @app.route('/shutdown-camera', methods=['POST'], defaults={"cam_id": None})
+    @app.route('/shutdown-camera/<cam_id>', methods=['POST'])
+    def shutdown_camera_route(cam_id):
+        if cam_id is not None:
+            _lookup_camera(cam_id)
         try:
             schedule_cleanup()
-            if shutdown_camera():
+            if shutdown_camera(cam_id):
                 return jsonify({"message": "Camera shut down successfully."})
             return jsonify({"message": "Camera was not active."}), 400
         except Exception as e:
@@ -0,0 +1,254 @@
+"""Frames shared between processes through a `multiprocessing.shared_memory` ring.
+
+The capture process (`run.py --role capture`) owns the devices and publishes every
+frame its grabbers read into one shared memory segment per camera. Worker processes
+(`run.py --role worker`) open the "shared" frame source instead of a device, so each
+runs its own grabber, encode pool and streams on top of the same frames, and serving
+scales across cores instead of sharing one interpreter lock.
+
+Segment layout: a 64-byte header (magic, version, slot count, slot size, publisher
+pid, newest sequence number, last reader heartbeat), one 64-byte header per slot
+(begin seq, end seq, height, width, channels), then the slots' pixel data. The
+publisher writes a slot's begin seq, the pixels, its end seq and finally the newest
+seq; a reader copies a slot and keeps the copy only if both markers still match the
+seq it wanted, so a slot overwritten during the copy is never returned half written.
+"""
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import psutil
+
+from app import metrics
+from app.config import SHARED_FRAMES_PREFIX, SHARED_FRAMES_SLOTS, SHARED_FRAMES_MAX_BYTES
+from app.sources import FrameSource
+
+MAGIC = b"CAMF"
+VERSION = 1
+
+HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64
+_LAYOUT = struct.Struct("<4sB3xIQI")    # magic, version, slots, slot bytes, publisher pid
+_SEQ_OFFSET = 32
+_HEARTBEAT_OFFSET = 40
+_SEQ = struct.Struct("<Q")
+_HEARTBEAT = struct.Struct("<d")
+_SLOT = struct.Struct("<QQIII")         # begin seq, end seq, height, width, channels (0 for grayscale)
+
+# Readers poll for new frames this often, and report a failed read after this long without one
+POLL_INTERVAL = 0.002
+READ_TIMEOUT = 0.5
+# The publisher keeps its camera open while a reader has polled within this many seconds
+DEMAND_TIMEOUT = 1.0
+
+
+def segment_name(cam_id, prefix=SHARED_FRAMES_PREFIX):
+    return f"{prefix}{cam_id}"
+
+
+def _attach(name):
+    from multiprocessing import resource_tracker, shared_memory
+
+    shm = shared_memory.SharedMemory(name)
+    # Before Python 3.13 attaching registers the segment with this process's resource
+    # tracker, which would unlink it (under the publisher's feet) when this process exits
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedFramePublisher:
+    """Copies every frame one camera's grabber publishes into that camera's shared memory ring."""
+
+    def __init__(self, cam, slots=SHARED_FRAMES_SLOTS, max_frame_bytes=SHARED_FRAMES_MAX_BYTES):
+        from multiprocessing import shared_memory
+
+        self.cam = cam
+        self.name = segment_name(cam.id)
+        self.slots = max(2, slots)
+        self.max_frame_bytes = max_frame_bytes
+        self.seq = 0
+        self.frames_published = 0
+        self.frames_skipped = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stopping = threading.Event()
+
+        size = HEADER_SIZE + self.slots * (SLOT_HEADER_SIZE + max_frame_bytes)
+        try:
+            self._shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a capture process that did not exit cleanly
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        _LAYOUT.pack_into(self._shm.buf, 0, MAGIC, VERSION, self.slots, max_frame_bytes, os.getpid())
+        _SEQ.pack_into(self._shm.buf, _SEQ_OFFSET, 0)
+        _HEARTBEAT.pack_into(self._shm.buf, _HEARTBEAT_OFFSET, 0.0)
+        self._thread = threading.Thread(target=self._watch_demand, name=f"shared-frames-{cam.id}", daemon=True)
+
+    def start(self):
+        self.cam.grabber.add_listener(self._publish)
+        self._thread.start()
+        logging.info(f"Publishing camera {self.cam.id} frames to shared memory '{self.name}' "
+                     f"({self.slots} slots of {self.max_frame_bytes} bytes)")
+        return self
+
+    def _publish(self, item):
+        # Grabber thread
+        _, _, frame = item
+        if frame.dtype != np.uint8 or frame.nbytes > self.max_frame_bytes:
+            self.frames_skipped += 1
+            if self.frames_skipped == 1:
+                logging.warning(f"Camera {self.cam.id}: {frame.shape} {frame.dtype} frame does not fit a shared "
+                                f"memory slot of {self.max_frame_bytes} bytes (CAMERA_SHARED_FRAMES_MAX_BYTES)")
+            return
+        with self._lock:
+            if self._closed:
+                return
+            seq = self.seq + 1
+            slot = seq % self.slots
+            header = HEADER_SIZE + slot * SLOT_HEADER_SIZE
+            offset = HEADER_SIZE + self.slots * SLOT_HEADER_SIZE + slot * self.max_frame_bytes
+            channels = frame.shape[2] if frame.ndim == 3 else 0
+            buf = self._shm.buf
+            _SLOT.pack_into(buf, header, seq, 0, frame.shape[0], frame.shape[1], channels)
+            np.copyto(np.ndarray(frame.shape, np.uint8, buf, offset), frame)
+            _SEQ.pack_into(buf, header + 8, seq)
+            _SEQ.pack_into(buf, _SEQ_OFFSET, seq)
+            self.seq = seq
+            self.frames_published += 1
+
+    @property
+    def last_read(self):
+        return _HEARTBEAT.unpack_from(self._shm.buf, _HEARTBEAT_OFFSET)[0] if not self._closed else 0.0
+
+    def _watch_demand(self):
+        # Worker reads count as use of the camera, so the grabber's idle timeout applies to them too
+        while not self._stopping.wait(0.25):
+            if time.time() - self.last_read < DEMAND_TIMEOUT:
+                self.cam.grabber.request()
+
+    def stop(self):
+        self._stopping.set()
+        self.cam.grabber.remove_listener(self._publish)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._shm.close()
+            self._shm.unlink()
+        logging.info(f"Stopped publishing camera {self.cam.id} frames after {self.frames_published} frames")
+
+    def stats(self):
+        return {
+            "camera": self.cam.id,
+            "segment": self.name,
+            "seq": self.seq,
+            "frames_published": self.frames_published,
+            "frames_skipped": self.frames_skipped,
+            "readers_active": time.time() - self.last_read < DEMAND_TIMEOUT,
+        }
+
+
+class SharedFrameSource(FrameSource):
+    """Reads the newest frames a capture process publishes, through the same API as a camera device."""
+
+    def __init__(self, name, timeout=READ_TIMEOUT):
+        self.description = f"shared memory '{name}'"
+        self.timeout = timeout
+        self._shm = None
+        self._stale = False
+        try:
+            shm = _attach(name)
+        except FileNotFoundError:
+            logging.error(f"No shared memory frames at '{name}'; is the capture process running?")
+            return
+        magic, version, self._slots, self._slot_bytes, self._pid = _LAYOUT.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            logging.error(f"Shared memory '{name}' does not hold frames in a known layout")
+            shm.close()
+            return
+        self._shm = shm
+        # Only frames published from now on; the newest one may be long stale if the camera was closed
+        self._last_seq = self._latest()
+
+    def _latest(self):
+        return _SEQ.unpack_from(self._shm.buf, _SEQ_OFFSET)[0]
+
+    def isOpened(self):
+        return self._shm is not None and not self._stale
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        buf = self._shm.buf
+        deadline = time.monotonic() + self.timeout
+        while True:
+            _HEARTBEAT.pack_into(buf, _HEARTBEAT_OFFSET, time.time())
+            seq = self._latest()
+            if seq > self._last_seq:
+                frame = self._copy(seq)
+                if frame is not None:
+                    self._last_seq = seq
+                    return True, frame
+                # Overwritten while copying; a newer frame is already there
+                continue
+            if time.monotonic() > deadline:
+                if not psutil.pid_exists(self._pid):
+                    logging.error(f"Capture process {self._pid} publishing {self.description} has exited")
+                    self._stale = True
+                return False, None
+            time.sleep(POLL_INTERVAL)
+
+    def _copy(self, seq):
+        buf = self._shm.buf
+        slot = seq % self._slots
+        header = HEADER_SIZE + slot * SLOT_HEADER_SIZE
+        _, end, height, width, channels = _SLOT.unpack_from(buf, header)
+        if end != seq:
+            return None
+        offset = HEADER_SIZE + self._slots * SLOT_HEADER_SIZE + slot * self._slot_bytes
+        frame = np.ndarray((height, width, channels) if channels else (height, width), np.uint8, buf, offset).copy()
+        begin = _SEQ.unpack_from(buf, header)[0]
+        return frame if begin == seq else None
+
+    def release(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+# Active publishers, keyed by camera id
+publishers = {}
+
+
+def publish_cameras(cameras):
+    """Start publishing every camera's frames to shared memory (capture process)."""
+    for cam in cameras:
+        if cam.id not in publishers:
+            publishers[cam.id] = SharedFramePublisher(cam).start()
+
+
+def stop_publishing():
+    for cam_id in list(publishers):
+        publishers.pop(cam_id).stop()
+
+
+# Unlink the segments so they do not outlive the capture process
+atexit.register(stop_publishing)
+
+
+def _collect_metrics():
+    active = list(publishers.values())
+    yield "camera_shared_frames_published_total", "counter", "Frames copied into shared memory for worker processes", [
+        ({"camera": publisher.cam.id}, publisher.frames_published) for publisher in active]
+    yield "camera_shared_frames_skipped_total", "counter", "Frames too large for a shared memory slot", [
+        ({"camera": publisher.cam.id}, publisher.frames_skipped) for publisher in active]
+
+
+metrics.register_collector(_collect_metrics)
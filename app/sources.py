@@ -0,0 +1,205 @@
+import glob
+import logging
+import os
+import time
+
+from app.utils import lazy_import
+
+
+# OpenCV capture backends selectable by name (cv2 constant names)
+CAPTURE_BACKENDS = {
+    "any": "CAP_ANY",
+    "dshow": "CAP_DSHOW",
+    "msmf": "CAP_MSMF",
+    "v4l2": "CAP_V4L2",
+    "avfoundation": "CAP_AVFOUNDATION",
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+SYNTHETIC_SIZE = (640, 480)
+SYNTHETIC_FPS = 30.0
+
+
+class FrameSource:
+    """Something the grabber can read BGR frames from.
+
+    Mirrors the subset of the `cv2.VideoCapture` API the grabber uses, so a plain
+    VideoCapture and any of the backends below are interchangeable.
+    """
+
+    description = "frame source"
+
+    def isOpened(self):
+        raise NotImplementedError
+
+    def read(self):
+        """Return (success, frame)."""
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class _Pacer:
+    """Sleeps so that successive ticks are spaced 1/fps apart."""
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps and fps > 0 else 0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next is None or now - self._next > self.interval:
+            # First tick, or we fell behind by more than a frame: resynchronise
+            self._next = now
+        elif self._next > now:
+            time.sleep(self._next - now)
+        self._next += self.interval
+
+
+class DeviceSource(FrameSource):
+    """A physical camera opened through any OpenCV capture backend."""
+
+    def __init__(self, index=0, backend="any", width=0, height=0):
+        cv2 = lazy_import("cv2")
+        self.description = f"device {index} ({backend})"
+        self._capture = cv2.VideoCapture(index, getattr(cv2, CAPTURE_BACKENDS.get(backend, "CAP_ANY")))
+        if width:
+            self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self._capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def read(self):
+        return self._capture.read()
+
+    def release(self):
+        self._capture.release()
+
+
+class FileSource(FrameSource):
+    """Replays a video file, an image directory or an image glob in a loop at a fixed fps."""
+
+    def __init__(self, path, fps=0, width=0, height=0, loop=True):
+        cv2 = lazy_import("cv2")
+        self.description = f"file {path}"
+        self.loop = loop
+        self._size = (width, height) if width and height else None
+        self._images = []
+        self._index = 0
+        self._capture = None
+
+        if os.path.isdir(path):
+            self._images = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        elif glob.has_magic(path):
+            self._images = sorted(glob.glob(path))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            self._images = [path]
+        else:
+            self._capture = cv2.VideoCapture(path)
+            if not fps and self._capture.isOpened():
+                fps = self._capture.get(cv2.CAP_PROP_FPS)
+
+        self._pacer = _Pacer(fps or SYNTHETIC_FPS)
+
+    def isOpened(self):
+        if self._capture is not None:
+            return self._capture.isOpened()
+        return bool(self._images)
+
+    def read(self):
+        cv2 = lazy_import("cv2")
+        self._pacer.wait()
+        if self._capture is not None:
+            success, frame = self._capture.read()
+            if not success and self.loop:
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                success, frame = self._capture.read()
+        else:
+            success, frame = self._read_image()
+
+        if success and self._size is not None:
+            frame = cv2.resize(frame, self._size, interpolation=cv2.INTER_AREA)
+        return success, frame
+
+    def _read_image(self):
+        if self._index >= len(self._images):
+            if not self.loop:
+                return False, None
+            self._index = 0
+        path = self._images[self._index]
+        self._index += 1
+        frame = lazy_import("cv2").imread(path)
+        return frame is not None, frame
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+
+
+class SyntheticSource(FrameSource):
+    """Deterministic moving test pattern, for running without any camera attached."""
+
+    def __init__(self, fps=0, width=0, height=0):
+        np = lazy_import("numpy")
+        width = width or SYNTHETIC_SIZE[0]
+        height = height or SYNTHETIC_SIZE[1]
+        self.description = f"synthetic {width}x{height}"
+        self._pacer = _Pacer(fps or SYNTHETIC_FPS)
+        self._count = 0
+        self._opened = True
+
+        # Colour gradient that scrolls one step per frame
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self._pattern = np.empty((height, width, 3), dtype=np.uint8)
+        self._pattern[..., 0] = x
+        self._pattern[..., 1] = y
+        self._pattern[..., 2] = (x + y) / 2
+        self._step = max(1, width // 120)
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        self._pacer.wait()
+        self._count += 1
+        cv2, np = lazy_import("cv2"), lazy_import("numpy")
+        frame = np.roll(self._pattern, self._count * self._step, axis=1)
+        cv2.putText(frame, f"#{self._count}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+        return True, frame
+
+    def release(self):
+        self._opened = False
+
+
+def open_source(source="device", device=0, backend="any", path="", fps=0, width=0, height=0):
+    """Create the configured frame source, or return None if it could not be opened."""
+    if source == "device":
+        cap = DeviceSource(device, backend, width, height)
+    elif source == "file":
+        cap = FileSource(path, fps, width, height)
+    elif source == "synthetic":
+        cap = SyntheticSource(fps, width, height)
+    elif source == "shared":
+        from app.sharedframes import SharedFrameSource, segment_name
+        cap = SharedFrameSource(segment_name(device))
+    else:
+        logging.error(f"Unknown frame source: {source}")
+        return None
+
+    if not cap.isOpened():
+        logging.error(f"Failed to open {cap.description}")
+        cap.release()
+        return None
+    return cap
@@ -0,0 +1,94 @@
+"""Startup phase timings, reported by /ready.
+
+The app is created and starts serving before any camera is opened; OpenCV is imported
+and the cameras are warmed up by a background thread, and each step is timed here.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from app.grabber import CLOSED
+from app.utils import lazy_import
+
+# Phase name -> seconds, in the order the phases finished
+phases = {}
+started_at = time.time()
+_warm_start_done = threading.Event()
+# Cameras opened by the warm start; /ready requires the default one among them to be available
+_warmed = []
+
+
+def record(name, seconds):
+    phases[name] = round(seconds, 3)
+    logging.info(f"Startup phase {name}: {seconds:.3f}s")
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def _warm_start(cameras):
+    try:
+        with phase("opencv_import"):
+            lazy_import("cv2")
+            lazy_import("numpy")
+
+        from app.encoding import get_pool, get_encoder, encoding_options
+        with phase("encoder"):
+            get_pool()
+            get_encoder(encoding_options["encoder"])
+
+        # Open every camera at once; each is timed from the start of the warm start phase
+        started = time.perf_counter()
+        for cam in cameras:
+            cam.grabber.request()
+        for cam in cameras:
+            _warmed.append(cam)
+            cam.ensure()
+            record(f"camera_{cam.id}", time.perf_counter() - started)
+    except Exception as e:
+        logging.error(f"Background warm start failed: {e}", exc_info=True)
+    finally:
+        record("ready", time.time() - started_at)
+        _warm_start_done.set()
+
+
+def warm_start(cameras):
+    """Import OpenCV and open `cameras` in a background thread, so serving can start right away."""
+    _warmed.clear()
+    _warm_start_done.clear()
+    phases.pop("ready", None)
+    threading.Thread(target=_warm_start, args=(list(cameras),),
+                     name="warm-start", daemon=True).start()
+
+
+def skip_warm_start():
+    """Report ready immediately; cameras are opened by the first request that needs them."""
+    record("ready", time.time() - started_at)
+    _warm_start_done.set()
+
+
+def status(default_camera):
+    """Readiness: the warm start has finished and the default camera (if it was warmed) is available.
+
+    Availability is the grabber's live state, so a camera missing at startup counts once it
+    opens; while it is missing and closed, each call asks the grabber to try it again.
+    """
+    done = _warm_start_done.is_set()
+    cameras = {cam.id: bool(cam.grabber.available) for cam in list(_warmed)}
+    default_ok = cameras.get(default_camera.id, True)
+    if done and not default_ok and default_camera.grabber.state == CLOSED:
+        default_camera.grabber.request()
+    return {
+        "ready": done and default_ok,
+        "warm_start_done": done,
+        "uptime": round(time.time() - started_at, 3),
+        "cameras": cameras,
+        "phases": dict(phases),
+    }
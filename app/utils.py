@@ -39,8 +39,24 @@ import logging
 import socket
 import time
 import os
+import importlib
 import psutil
 
+# Modules loaded through lazy_import(), by name
+_lazy_modules = {}
+
+
+def lazy_import(name):
+    """Returns module `name`, importing it on the first call.
+
+    OpenCV and numpy are loaded this way so that importing the app (and starting to serve)
+    does not wait for them; later calls are a dict lookup, cheap enough for per-frame code.
+    """
+    module = _lazy_modules.get(name)
+    if module is None:
+        module = _lazy_modules[name] = importlib.import_module(name)
+    return module
+
 
 def get_host_ip():
     """Attempts to get the local IP address by connecting to a public DNS server."""
@@ -0,0 +1,76 @@
+"""Compare the installed JPEG encoder backends on synthetic frames.
+
+    python -m benchmarks.encoders --width 1920 --height 1080 --frames 100
+
+Reports per-frame encode latency for each encoder, single-threaded and through the
+encode pool, and writes the numbers to a JSON file alongside the load test results.
+"""
+import argparse
+import json
+import os
+import time
+
+from app.encoding import EncodePool, available_encoders, encode_jpeg
+from app.sources import SyntheticSource
+from benchmarks.load_test import percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark JPEG encoder backends.")
+    parser.add_argument("--width", type=int, default=1920, help="Frame width")
+    parser.add_argument("--height", type=int, default=1080, help="Frame height")
+    parser.add_argument("--frames", type=int, default=100, help="Frames encoded per encoder")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Encode pool size")
+    parser.add_argument("--output", type=str, default="bench_encoders.json", help="Report file")
+    return parser.parse_args()
+
+
+def bench_encoder(name, frames, quality, workers):
+    latencies = []
+    size = 0
+    for frame in frames:
+        start = time.perf_counter()
+        size += len(encode_jpeg(frame, quality, encoder=name))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    pool = EncodePool(workers, encoder=name)
+    start = time.perf_counter()
+    for future in [pool.submit(frame, quality, None) for frame in frames]:
+        future.result()
+    pool_seconds = time.perf_counter() - start
+    pool.shutdown()
+
+    return {
+        "encoder": name,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "avg_bytes": size // len(frames),
+        "single_thread_fps": round(len(frames) / (sum(latencies) / 1000), 1),
+        "pool_fps": round(len(frames) / pool_seconds, 1),
+    }
+
+
+def main():
+    args = parse_args()
+    source = SyntheticSource(fps=1000, width=args.width, height=args.height)
+    frames = [source.read()[1] for _ in range(args.frames)]
+
+    results = [bench_encoder(name, frames, args.quality, args.workers) for name in available_encoders()]
+    report = {
+        "frame_size": [args.width, args.height],
+        "quality": args.quality,
+        "workers": args.workers,
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        print(f"{result['encoder']:>10}: p50 {result['p50_ms']} ms, {result['single_thread_fps']} fps single, "
+              f"{result['pool_fps']} fps with {args.workers} workers")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Load test for /video_feed, /capture and /image against a synthetic frame source.
+
+Starts the server in a child process, drives a mix of MJPEG viewers and capture
+callers from this process, and writes a JSON report with per-client fps, capture
+latency percentiles, throughput and server CPU/RSS.
+
+    python -m benchmarks.load_test --streams 10 --capturers 2 --duration 30
+"""
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+
+import psutil
+
+BOUNDARY = b'--frame'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the camera server.")
+    parser.add_argument("--streams", type=int, default=4, help="Concurrent /video_feed clients")
+    parser.add_argument("--capturers", type=int, default=1, help="Concurrent /capture + /image callers")
+    parser.add_argument("--capture-interval", type=float, default=0.5,
+                        help="Pause between capture requests per caller in seconds (0 = back to back)")
+    parser.add_argument("--duration", type=float, default=20, help="Measured run time in seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds to let the server settle first")
+    parser.add_argument("--fps", type=float, default=30, help="Synthetic source frame rate")
+    parser.add_argument("--width", type=int, default=1280, help="Synthetic frame width")
+    parser.add_argument("--height", type=int, default=720, help="Synthetic frame height")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Waitress worker threads (default: enough for every client)")
+    parser.add_argument("--encoder", type=str, default=None, help="JPEG encoder backend for the server")
+    parser.add_argument("--encode-workers", type=int, default=None, help="Server encode pool size")
+    parser.add_argument("--port", type=int, default=0, help="Server port (default: any free port)")
+    parser.add_argument("--label", type=str, default="", help="Free-form label stored in the report")
+    parser.add_argument("--output", type=str, default="bench_results.json", help="Report file")
+    return parser.parse_args()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(port, threads, source_options, encoding):
+    from waitress import serve
+    from app import create_app
+    from app.encoding import configure_encoding
+
+    configure_encoding(**encoding)
+    app = create_app(source_options)
+    serve(app, host="127.0.0.1", port=port, threads=threads, _quiet=True)
+
+
+def _wait_for_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+        try:
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.2)
+    return False
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (milliseconds), or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered) / 100.0) - 1))
+    return round(ordered[rank], 3)
+
+
+def _latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "max_ms": round(max(samples), 3) if samples else None,
+    }
+
+
+class StreamClient(threading.Thread):
+    """Reads /video_feed and counts delivered multipart frames."""
+
+    def __init__(self, port, stop, measure_from):
+        super().__init__(daemon=True)
+        self.port = port
+        self.stop = stop
+        self.measure_from = measure_from
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+            conn.request("GET", "/video_feed")
+            response = conn.getresponse()
+            tail = b''
+            while not self.stop.is_set():
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                if time.time() < self.measure_from:
+                    continue
+                data = tail + chunk
+                self.frames += data.count(BOUNDARY)
+                self.bytes += len(chunk)
+                tail = data[-(len(BOUNDARY) - 1):]
+            conn.close()
+        except Exception as e:
+            self.error = str(e)
+
+
+class CaptureClient(threading.Thread):
+    """Repeatedly POSTs /capture then GETs /image, recording latencies in milliseconds."""
+
+    def __init__(self, port, stop, measure_from, interval):
+        super().__init__(daemon=True)
+        self.port = port
+        self.stop = stop
+        self.measure_from = measure_from
+        self.interval = interval
+        self.capture_ms = []
+        self.image_ms = []
+        self.bytes = 0
+        self.failures = 0
+
+    def _timed(self, conn, method, path):
+        start = time.perf_counter()
+        conn.request(method, path)
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, body, (time.perf_counter() - start) * 1000
+
+    def run(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        while not self.stop.is_set():
+            try:
+                status, _, capture_ms = self._timed(conn, "POST", "/capture")
+                image_status, body, image_ms = self._timed(conn, "GET", "/image")
+            except (OSError, http.client.HTTPException):
+                self.failures += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                continue
+
+            if time.time() >= self.measure_from:
+                if status != 200 or image_status != 200:
+                    self.failures += 1
+                else:
+                    self.capture_ms.append(capture_ms)
+                    self.image_ms.append(image_ms)
+                    self.bytes += len(body)
+            if self.interval:
+                self.stop.wait(self.interval)
+        conn.close()
+
+
+def _sample_process(process, stop, samples):
+    process.cpu_percent(None)
+    while not stop.wait(0.5):
+        try:
+            with process.oneshot():
+                samples.append((process.cpu_percent(None), process.memory_info().rss))
+        except psutil.NoSuchProcess:
+            break
+
+
+def run_benchmark(args):
+    port = args.port or _free_port()
+    threads = args.threads or max(8, args.streams + args.capturers + 4)
+    source_options = {"source": "synthetic", "fps": args.fps, "width": args.width, "height": args.height}
+
+    encoding = {"encoder": args.encoder, "workers": args.encode_workers}
+    server = multiprocessing.Process(target=_serve, args=(port, threads, source_options, encoding), daemon=True)
+    server.start()
+    try:
+        if not _wait_for_server(port):
+            raise RuntimeError("Server did not come up")
+
+        stop = threading.Event()
+        measure_from = time.time() + args.warmup
+        streams = [StreamClient(port, stop, measure_from) for _ in range(args.streams)]
+        capturers = [CaptureClient(port, stop, measure_from, args.capture_interval) for _ in range(args.capturers)]
+        for client in streams + capturers:
+            client.start()
+
+        samples = []
+        time.sleep(args.warmup)
+        sampler = threading.Thread(target=_sample_process, args=(psutil.Process(server.pid), stop, samples), daemon=True)
+        sampler.start()
+
+        time.sleep(args.duration)
+        stop.set()
+        for client in streams + capturers:
+            client.join(timeout=10)
+        sampler.join(timeout=2)
+    finally:
+        server.terminate()
+        server.join(timeout=5)
+
+    duration = args.duration
+    capture_ms = [ms for c in capturers for ms in c.capture_ms]
+    image_ms = [ms for c in capturers for ms in c.image_ms]
+    stream_bytes = sum(c.bytes for c in streams)
+    image_bytes = sum(c.bytes for c in capturers)
+    cpu = [sample[0] for sample in samples]
+    rss = [sample[1] for sample in samples]
+
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "streams": args.streams,
+            "capturers": args.capturers,
+            "capture_interval_s": args.capture_interval,
+            "duration_s": duration,
+            "source_fps": args.fps,
+            "frame_size": [args.width, args.height],
+            "waitress_threads": threads,
+            "encoder": args.encoder or "default",
+            "encode_workers": args.encode_workers or "default",
+        },
+        "streams": [
+            {
+                "frames": c.frames,
+                "fps": round(c.frames / duration, 2),
+                "bytes_per_sec": round(c.bytes / duration),
+                "error": c.error,
+            }
+            for c in streams
+        ],
+        "capture_latency": _latency_summary(capture_ms),
+        "image_latency": _latency_summary(image_ms),
+        "capture_requests_per_sec": round(len(capture_ms) / duration, 2),
+        "capture_failures": sum(c.failures for c in capturers),
+        "throughput": {
+            "stream_bytes_per_sec": round(stream_bytes / duration),
+            "image_bytes_per_sec": round(image_bytes / duration),
+        },
+        "server_process": {
+            "cpu_percent_avg": round(sum(cpu) / len(cpu), 1) if cpu else None,
+            "cpu_percent_max": round(max(cpu), 1) if cpu else None,
+            "rss_bytes_max": max(rss) if rss else None,
+        },
+    }
+
+
+def main():
+    args = parse_args()
+    report = run_benchmark(args)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    fps = [s["fps"] for s in report["streams"]]
+    print(f"Streams: {len(fps)} clients, fps min/avg {min(fps, default=0)}/{round(sum(fps) / len(fps), 2) if fps else 0}")
+    latency = report["capture_latency"]
+    print(f"Capture: {report['capture_requests_per_sec']} req/s, "
+          f"p50/p95/p99 {latency['p50_ms']}/{latency['p95_ms']}/{latency['p99_ms']} ms")
+    print(f"Server: {report['server_process']['cpu_percent_avg']}% CPU avg, "
+          f"{report['server_process']['rss_bytes_max']} bytes RSS max")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -57,15 +57,22 @@ import threading
 import os
 import sys
 import atexit
-import msvcrt
 import psutil
 import logging
 from app import create_app
 from app.utils import get_host_ip, monitor_parent_process
 from app.logging_config import setup_logging
+from app.sources import CAPTURE_BACKENDS
+from app.encoding import ENCODERS, configure_encoding
+from app.config import RAW_FRAME_SOCKET
 from waitress import serve
 from pathlib import Path
 
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
 # Set lock file in a writable user directory
 if sys.platform == "win32":
     base_dir = os.getenv("LOCALAPPDATA", os.path.expanduser("~\\AppData\\Local"))
@@ -79,11 +86,25 @@ LOCKFILE = os.path.join(lock_dir, "flask_camera_server.lock")
 lockfile_handle = None  # Global lockfile handle
 
 
+def _lock(handle):
+    if sys.platform == "win32":
+        msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock(handle):
+    if sys.platform == "win32":
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
 def acquire_lock():
     global lockfile_handle
     try:
         lockfile_handle = open(LOCKFILE, 'w+')
-        msvcrt.locking(lockfile_handle.fileno(), msvcrt.LK_NBLCK, 1)
+        _lock(lockfile_handle)
 
         try:
             lockfile_handle.seek(0)
@@ -113,7 +134,7 @@ def release_lock():
     global lockfile_handle
     if lockfile_handle:
         try:
-            msvcrt.locking(lockfile_handle.fileno(), msvcrt.LK_UNLCK, 1)
+            _unlock(lockfile_handle)
             lockfile_handle.close()
             os.remove(LOCKFILE)
         except Exception as e:
@@ -127,26 +148,74 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Start the Flask camera server.")
     parser.add_argument("--host", type=str, help="Host to run on", default=None)
     parser.add_argument("--port", type=int, help="Port to run on", default=5000)
+    parser.add_argument("--server", choices=["waitress", "asgi"], default="waitress",
+                        help="Serving mode: threaded waitress, or asyncio (uvicorn) for many concurrent streams")
+    parser.add_argument("--source", choices=["device", "file", "synthetic", "shared"], default=None,
+                        help="Frame source backend (default: CAMERA_SOURCE or device)")
+    parser.add_argument("--device", type=int, default=None, help="Camera device index")
+    parser.add_argument("--devices", type=str, default=None,
+                        help="Comma-separated device indexes to serve as separate cameras, e.g. 0,1,2")
+    parser.add_argument("--backend", choices=sorted(CAPTURE_BACKENDS), default=None,
+                        help="OpenCV capture backend for device sources")
+    parser.add_argument("--source-path", type=str, default=None,
+                        help="Video file, image directory or glob replayed by the file source")
+    parser.add_argument("--fps", type=float, default=None, help="Frame rate for file/synthetic sources")
+    parser.add_argument("--width", type=int, default=None, help="Requested frame width")
+    parser.add_argument("--height", type=int, default=None, help="Requested frame height")
+    parser.add_argument("--encoder", choices=sorted(ENCODERS), default=None,
+                        help="JPEG encoder backend (default: CAMERA_JPEG_ENCODER or opencv)")
+    parser.add_argument("--encode-workers", type=int, default=None, help="Encode pool size (default: one per core)")
+    parser.add_argument("--encode-pool", choices=["thread", "process"], default=None, help="Encode pool kind")
+    parser.add_argument("--raw-socket", type=str, default=RAW_FRAME_SOCKET or None,
+                        help="Also serve raw frames on this Unix socket path (default: CAMERA_RAW_FRAME_SOCKET)")
+    parser.add_argument("--role", choices=["single", "capture", "worker"], default="single",
+                        help="single: own the cameras and serve; capture: also publish frames to shared memory; "
+                             "worker: serve frames published by the capture process (run several on different ports)")
     return parser.parse_args()
 
 
 def main():
-    acquire_lock()
+    args = parse_args()
+    # Only one process may own the cameras; workers attach to its shared memory instead
+    if args.role != "worker":
+        acquire_lock()
 
     setup_logging()
     logger = logging.getLogger(__name__)
 
-    args = parse_args()
     host = args.host or get_host_ip()
     port = args.port
 
     logger.info(f"Starting server on http://{host}:{port}")
-    app = create_app()
+    configure_encoding(encoder=args.encoder, workers=args.encode_workers, pool=args.encode_pool)
+    app = create_app({
+        "devices": [int(index) for index in args.devices.split(",")] if args.devices else None,
+        "source": "shared" if args.role == "worker" else args.source,
+        "device": args.device,
+        "backend": args.backend,
+        "path": args.source_path,
+        "fps": args.fps,
+        "width": args.width,
+        "height": args.height,
+    })
 
     threading.Thread(target=monitor_parent_process, daemon=True).start()
 
+    if args.role == "capture":
+        from app.camera import cameras
+        from app.sharedframes import publish_cameras
+        publish_cameras(cameras.values())
+
+    if args.raw_socket:
+        from app.rawframes import RawFrameServer
+        RawFrameServer(args.raw_socket).start()
+
     try:
-        serve(app, host=host, port=port)
+        if args.server == "asgi":
+            from app.asgi import serve_asgi
+            serve_asgi(app, host=host, port=port)
+        else:
+            serve(app, host=host, port=port)
     except KeyboardInterrupt:
         print("Shutting down via KeyboardInterrupt")
         from app.camera import shutdown_server